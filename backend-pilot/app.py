@@ -3,104 +3,292 @@ Application FastAPI pour le backend pilote avec interface Leaflet
 """
 
 import asyncio
-import json
-from typing import List
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Union
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Request
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
 import uvicorn
 
-from kafka_service import KafkaPilotService
+from config import GLOBAL_CONFIG
+from kafka_service import LOG_LEVELS, KafkaPilotService
+from leaderboard import LeaderboardService
+from profiling import AllocationTracker, SamplingProfiler
+from replay import ReplaySession
+from serialization import Envelope, dumps, loads
+from static_assets import REVALIDATE_CACHE, Asset, StaticAssets, asset_response
 
 # Créer l'instance FastAPI
 app = FastAPI(title="Backend Pilot", description="Pilot application with Kafka and Leaflet map")
 
 # Configurer les templates et fichiers statiques
+# Les fichiers statiques sont chargés et compressés une seule fois, et la page
+# d'accueil est rendue une seule fois avec les URLs hashées des assets
 templates = Jinja2Templates(directory="templates")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+static_assets = StaticAssets(directory="static").build()
+templates.env.globals["static_url"] = static_assets.url
+homepage = Asset("index.html", templates.get_template("index.html").render().encode("utf-8"), "text/html")
 
 # Instance du service Kafka
 kafka_service = KafkaPilotService()
 
+# Classement des pilotes alimenté par le topic des checkpoints
+leaderboard_service = LeaderboardService.from_config()
+
+REPLAY_MAX_SPEED = GLOBAL_CONFIG.getfloat('DEFAULT', 'replay_max_speed', fallback=100.0)
+
+# Profilage à la demande (rien ne tourne tant qu'aucun profil n'est démarré)
+PROFILING_ENABLED = GLOBAL_CONFIG.getboolean('DEFAULT', 'profiling_enabled', fallback=False)
+profiler = SamplingProfiler.from_config()
+allocation_tracker = AllocationTracker.from_config()
+
 # Liste des connexions WebSocket actives
 active_connections: List[WebSocket] = []
 
+# Canaux de diffusion WebSocket ; les messages instruction/status concernent ce pilote
+CHANNELS = ("instruction", "log", "status", "leaderboard")
+# Abonnement implicite des clients qui n'envoient jamais de "subscribe" (comportement historique)
+DEFAULT_CHANNELS = ("instruction", "log", "leaderboard")
+PILOT_ID = kafka_service.consumer_conf['group.id']
+
+# En-têtes des messages poussés, encodés une seule fois ; le payload déjà encodé y est inséré
+INSTRUCTION_ENVELOPE = Envelope("instruction")
+LOG_ENVELOPES = {level: Envelope("log", key="message", level=level) for level in LOG_LEVELS}
+
+
+class Subscription:
+    """Abonnements d'une connexion WebSocket"""
+
+    __slots__ = ("channels", "log_level", "pilots", "implicit")
+
+    def __init__(self, channels: Iterable[str], log_level: int = LOG_LEVELS["debug"],
+                 pilots: Optional[Set[str]] = None, implicit: bool = False):
+        self.channels = set(channels)
+        self.log_level = log_level
+        self.pilots = pilots  # None = tous les pilotes
+        self.implicit = implicit
+
+    def accepts(self, pilots: Optional[Iterable[str]]) -> bool:
+        return self.pilots is None or pilots is None or not self.pilots.isdisjoint(pilots)
+
+    def describe(self) -> Dict:
+        level_names = {value: name for name, value in LOG_LEVELS.items()}
+        return {
+            "channels": sorted(self.channels),
+            "log_level": level_names[self.log_level],
+            "pilots": sorted(self.pilots) if self.pilots is not None else None,
+        }
+
+
+def _string_list(name: str, value) -> List[str]:
+    """Valide un champ de message WebSocket qui doit être une liste de chaînes"""
+    if not isinstance(value, (list, tuple)) or not all(isinstance(item, str) for item in value):
+        raise ValueError(f"'{name}' must be a list of strings")
+    return list(value)
+
 
 class ConnectionManager:
-    """Gestionnaire des connexions WebSocket"""
+    """Gestionnaire des connexions WebSocket
+
+    Les connexions sont indexées par canal : une diffusion ne parcourt que
+    les abonnés du canal, et le message n'est sérialisé que s'il a au moins
+    un destinataire. Le premier "subscribe" d'un client qui choisit ses
+    canaux remplace son abonnement implicite, les suivants s'y ajoutent.
+    """
     
     def __init__(self):
         self.active_connections: List[WebSocket] = []
+        self.subscriptions: Dict[WebSocket, Subscription] = {}
+        self.channels: Dict[str, Set[WebSocket]] = {channel: set() for channel in CHANNELS}
+        # Niveau minimal demandé par au moins un abonné au canal log (None = aucun)
+        self.min_log_level: Optional[int] = None
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
         self.active_connections.append(websocket)
+        self._index(websocket, Subscription(DEFAULT_CHANNELS, implicit=True))
         print(f"WebSocket connected. Total connections: {len(self.active_connections)}")
 
     def disconnect(self, websocket: WebSocket):
         if websocket in self.active_connections:
             self.active_connections.remove(websocket)
+        self._unindex(websocket)
         print(f"WebSocket disconnected. Total connections: {len(self.active_connections)}")
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
-
-    async def broadcast(self, message: str):
-        """Diffuse un message à toutes les connexions actives"""
-        for connection in self.active_connections.copy():
+    def _index(self, websocket: WebSocket, subscription: Subscription):
+        self._unindex(websocket)
+        self.subscriptions[websocket] = subscription
+        for channel in subscription.channels:
+            self.channels[channel].add(websocket)
+        self._refresh_log_level()
+
+    def _unindex(self, websocket: WebSocket):
+        subscription = self.subscriptions.pop(websocket, None)
+        if subscription:
+            for channel in subscription.channels:
+                self.channels[channel].discard(websocket)
+            self._refresh_log_level()
+
+    def _refresh_log_level(self):
+        levels = [self.subscriptions[ws].log_level for ws in self.channels["log"] if ws in self.subscriptions]
+        self.min_log_level = min(levels) if levels else None
+
+    def subscribe(self, websocket: WebSocket, channels=..., log_level: Optional[str] = None,
+                  pilots=...) -> Subscription:
+        """Ajoute des canaux et/ou change le niveau de log et le filtre de pilotes d'une connexion
+
+        `channels` ou `pilots` absents (`...`) laissent l'abonnement inchangé
+        sur ce point ; `pilots=None` rétablit tous les pilotes.
+
+        Raises:
+            ValueError: canal ou niveau de log inconnu, ou canaux/pilotes qui
+                ne sont pas une liste de chaînes
+        """
+        if channels is not ...:
+            channels = _string_list("channels", channels)
+            unknown = [channel for channel in channels if channel not in CHANNELS]
+            if unknown:
+                raise ValueError(f"Unknown channel(s): {unknown}. Expected: {list(CHANNELS)}")
+        if log_level is not None and log_level not in LOG_LEVELS:
+            raise ValueError(f"Unknown log level '{log_level}'. Expected: {list(LOG_LEVELS)}")
+        if pilots is not ... and pilots is not None:
+            pilots = set(_string_list("pilots", pilots))
+
+        current = self.subscriptions.get(websocket) or Subscription(())
+        if channels is ...:
+            # Sans "channels", les canaux (implicites compris) sont conservés
+            channels, implicit = current.channels, current.implicit
+        else:
+            # Le premier choix explicite de canaux remplace l'abonnement implicite
+            channels, implicit = (set() if current.implicit else current.channels).union(channels), False
+        subscription = Subscription(
+            channels,
+            LOG_LEVELS[log_level] if log_level is not None else current.log_level,
+            current.pilots if pilots is ... else pilots,
+            implicit=implicit,
+        )
+        self._index(websocket, subscription)
+        return subscription
+
+    def unsubscribe(self, websocket: WebSocket, channels: Iterable[str]) -> Subscription:
+        """Retire des canaux de l'abonnement d'une connexion
+
+        Raises:
+            ValueError: canaux qui ne sont pas une liste de chaînes
+        """
+        channels = _string_list("channels", channels)
+        current = self.subscriptions.get(websocket) or Subscription(())
+        subscription = Subscription(current.channels.difference(channels), current.log_level, current.pilots)
+        self._index(websocket, subscription)
+        return subscription
+
+    def has_subscribers(self, channel: str) -> bool:
+        return bool(self.channels[channel])
+
+    def wants_log(self, level: int) -> bool:
+        """Filtre des logs du service Kafka : True si au moins un abonné veut ce niveau"""
+        min_level = self.min_log_level
+        return min_level is not None and level >= min_level
+
+    async def publish(self, channel: str, message: Union[dict, bytes], level: Optional[int] = None,
+                      pilots: Optional[Iterable[str]] = None):
+        """Diffuse un message (dict, ou JSON déjà encodé) aux abonnés d'un canal en trames binaires"""
+        subscribers = self.channels[channel]
+        if not subscribers:
+            return
+        data = message if isinstance(message, bytes) else None
+        for connection in list(subscribers):
+            subscription = self.subscriptions.get(connection)
+            if subscription is None or (level is not None and level < subscription.log_level):
+                continue
+            if not subscription.accepts(pilots):
+                continue
+            if data is None:
+                data = dumps(message)
             try:
-                await connection.send_text(message)
-            except:
-                # Connexion fermée, la retirer de la liste
-                self.active_connections.remove(connection)
+                await connection.send_bytes(data)
+            except Exception:
+                # Connexion fermée, la retirer des index
+                self.disconnect(connection)
 
-    async def broadcast_json(self, data: dict):
-        """Diffuse un message JSON à toutes les connexions actives"""
-        message = json.dumps(data)
-        await self.broadcast(message)
+    async def send_message(self, message: Union[dict, bytes], websocket: WebSocket):
+        """Envoie un message JSON à une connexion en trame binaire"""
+        await websocket.send_bytes(message if isinstance(message, bytes) else dumps(message))
 
 
 # Instance du gestionnaire de connexions
 manager = ConnectionManager()
 
 
-async def instruction_callback(instruction_data: dict):
-    """Callback appelé quand une nouvelle instruction est reçue"""
+async def instruction_callback(instruction_json: bytes):
+    """Callback appelé quand une nouvelle instruction est reçue (JSON déjà encodé et validé)"""
+    if manager.has_subscribers("instruction"):
+        message = INSTRUCTION_ENVELOPE.wrap(instruction_json)
+        await manager.publish("instruction", message, pilots=(PILOT_ID,))
+    # Les totaux (km, compteurs) changent à chaque instruction
+    await status_callback()
+
+
+async def status_callback():
+    """Callback appelé quand le statut ou les totaux du pilote changent"""
+    if not manager.has_subscribers("status"):
+        return
     message = {
-        "type": "instruction",
-        "data": instruction_data
+        "type": "status",
+        "data": kafka_service.get_stats()
     }
-    await manager.broadcast_json(message)
+    await manager.publish("status", message, pilots=(PILOT_ID,))
 
 
-async def log_callback(message: str):
+async def log_callback(message: str, level: str = "info"):
     """Callback pour les logs"""
-    log_message = {
-        "type": "log",
-        "message": message
+    if not manager.wants_log(LOG_LEVELS[level]):
+        return
+    log_message = LOG_ENVELOPES[level].wrap(dumps(message))
+    await manager.publish("log", log_message, level=LOG_LEVELS[level])
+
+
+async def leaderboard_callback(update: dict):
+    """Callback appelé quand des rangs du classement changent"""
+    message = {
+        "type": "leaderboard",
+        "data": update
     }
-    await manager.broadcast_json(log_message)
+    pilots = {change["group_id"] for change in update["changes"]}
+    await manager.publish("leaderboard", message, pilots=pilots)
 
 
 # Configurer les callbacks
 kafka_service.set_instruction_callback(instruction_callback)
+kafka_service.set_status_callback(status_callback)
+leaderboard_service.set_callback(leaderboard_callback)
 
 # Configure logger with error handling
-async def safe_log_callback(msg):
+async def safe_log_callback(msg, level="info"):
     try:
-        await log_callback(msg)
+        await log_callback(msg, level)
     except Exception as e:
         print(f"Error in log callback: {e}")
 
 kafka_service.set_logger(safe_log_callback)
+# Les logs d'un niveau que personne n'écoute ne sont ni formatés ni envoyés à la boucle
+kafka_service.set_log_filter(manager.wants_log)
 
 
 @app.get("/", response_class=HTMLResponse)
 async def get_homepage(request: Request):
-    """Page d'accueil avec la carte Leaflet"""
-    return templates.TemplateResponse("index.html", {"request": request})
+    """Page d'accueil avec la carte Leaflet (rendue au démarrage, servie depuis la mémoire)"""
+    return asset_response(request, homepage, REVALIDATE_CACHE)
+
+
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"])
+async def get_static(request: Request, path: str):
+    """Fichiers statiques précompressés (gzip/brotli) avec ETag et cache immuable pour les URLs hashées"""
+    response = static_assets.response(request, path)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return response
 
 
 @app.get("/api/status")
@@ -129,6 +317,7 @@ async def start_race():
 async def stop_service():
     """Arrête le service"""
     kafka_service.stop_consumption()
+    await kafka_service.wait_stopped()
     return {"success": True, "message": "Service stopped"}
 
 
@@ -136,9 +325,97 @@ async def stop_service():
 async def reset_service():
     """Remet à zéro le service"""
     kafka_service.reset()
+    await kafka_service.wait_stopped()
     return {"success": True, "message": "Service reset"}
 
 
+@app.get("/api/dead-letters")
+async def get_dead_letters():
+    """Retourne les compteurs de messages rejetés par raison"""
+    return kafka_service.dead_letters.get_stats()
+
+
+@app.get("/api/leaderboard")
+async def get_leaderboard(limit: Optional[int] = None):
+    """Retourne le top-K des pilotes par distance parcourue"""
+    return {
+        "top": leaderboard_service.leaderboard.ranking(limit),
+        **leaderboard_service.leaderboard.get_stats()
+    }
+
+
+@app.get("/api/replays")
+async def get_replays():
+    """Liste les courses enregistrées disponibles pour le rejeu"""
+    return {"races": kafka_service.replay.list_races()}
+
+
+def _require_profiling():
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+@app.post("/api/admin/profile/start")
+async def start_profile(duration_s: float = 30.0):
+    """Démarre un profil CPU échantillonné de la boucle asyncio et du thread consumer"""
+    _require_profiling()
+    # Ce handler s'exécute dans le thread de la boucle asyncio
+    threads = {threading.get_ident(): "event-loop"}
+    if kafka_service.consumer_thread_id is not None:
+        threads[kafka_service.consumer_thread_id] = "kafka-consumer"
+    if not profiler.start(threads, duration_s):
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return profiler.get_stats()
+
+
+@app.post("/api/admin/profile/stop", response_class=PlainTextResponse)
+async def stop_profile():
+    """Arrête le profil en cours et retourne les piles au format collapsed (flamegraph)"""
+    _require_profiling()
+    profiler.stop()
+    return profiler.collapsed()
+
+
+@app.get("/api/admin/profile")
+async def get_profile():
+    """État du dernier profil CPU"""
+    _require_profiling()
+    return profiler.get_stats()
+
+
+@app.get("/api/admin/profile/collapsed", response_class=PlainTextResponse)
+async def get_profile_collapsed():
+    """Piles du dernier profil au format collapsed, même s'il s'est arrêté seul"""
+    _require_profiling()
+    return profiler.collapsed()
+
+
+@app.post("/api/admin/allocations/start")
+async def start_allocations():
+    """Active tracemalloc et prend l'instantané de référence"""
+    _require_profiling()
+    allocation_tracker.start()
+    return allocation_tracker.get_stats()
+
+
+@app.get("/api/admin/allocations")
+async def get_allocations(limit: int = 20, rebase: bool = False):
+    """Top des sites d'allocation de kafka_service et app depuis la référence"""
+    _require_profiling()
+    top = allocation_tracker.diff(limit, rebase)
+    if top is None:
+        raise HTTPException(status_code=409, detail="Allocation tracking is not started")
+    return {"top": top, **allocation_tracker.get_stats()}
+
+
+@app.post("/api/admin/allocations/stop")
+async def stop_allocations():
+    """Désactive tracemalloc"""
+    _require_profiling()
+    allocation_tracker.stop()
+    return allocation_tracker.get_stats()
+
+
 @app.get("/api/test-connectivity")
 async def test_connectivity():
     """Teste la connectivité Kafka"""
@@ -156,13 +433,19 @@ async def websocket_endpoint(websocket: WebSocket):
         "type": "status",
         "data": kafka_service.get_stats()
     }
-    await manager.send_personal_message(json.dumps(initial_status), websocket)
+    await manager.send_message(initial_status, websocket)
+    
+    # Rejeu des courses enregistrées, propre à cette connexion
+    async def send_replay(message: Union[dict, bytes]):
+        await manager.send_message(message, websocket)
+    
+    replay_session = ReplaySession(kafka_service.replay, send_replay, max_speed=REPLAY_MAX_SPEED)
     
     try:
         while True:
             # Écouter les messages du client
             data = await websocket.receive_text()
-            message = json.loads(data)
+            message = loads(data)
             
             if message.get("type") == "ping":
                 # Répondre au ping avec le statut
@@ -170,9 +453,31 @@ async def websocket_endpoint(websocket: WebSocket):
                     "type": "pong",
                     "data": kafka_service.get_stats()
                 }
-                await manager.send_personal_message(json.dumps(response), websocket)
+                await manager.send_message(response, websocket)
+            
+            elif message.get("type") in ("subscribe", "unsubscribe"):
+                # {"type": "subscribe", "channels": ["instruction", "log", "status", "leaderboard"],
+                #  "log_level": "debug"|"info"|"warning"|"error", "pilots": ["group-id", ...] | null}
+                try:
+                    if message["type"] == "subscribe":
+                        subscription = manager.subscribe(websocket, message.get("channels", ...),
+                                                         message.get("log_level"), message.get("pilots", ...))
+                    else:
+                        subscription = manager.unsubscribe(websocket, message.get("channels", []))
+                    response = {"type": "subscribed", **subscription.describe()}
+                except ValueError as e:
+                    response = {"type": "error", "message": str(e)}
+                await manager.send_message(response, websocket)
+            
+            elif message.get("type") == "replay":
+                # {"type": "replay", "action": "play"|"step"|"stop", "race_id": ..., "from_ms": ..., "speed": 1-100}
+                await replay_session.handle(message)
                 
     except WebSocketDisconnect:
+        pass
+    finally:
+        # Toute sortie de la boucle (déconnexion ou erreur) libère la connexion
+        replay_session.stop()
         manager.disconnect(websocket)
 
 
@@ -184,13 +489,22 @@ async def startup_event():
     
     # Test de connectivité en arrière-plan
     asyncio.create_task(test_kafka_connectivity())
+    
+    # Consommation du topic des checkpoints pour le classement
+    leaderboard_service.start(asyncio.get_running_loop())
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Nettoyage à l'arrêt de l'application"""
     print("🛑 Backend Pilot shutting down...")
+    profiler.stop()
+    allocation_tracker.stop()
     kafka_service.stop_consumption()
+    await kafka_service.wait_stopped()
+    leaderboard_service.stop()
+    kafka_service.dead_letters.close()
+    kafka_service.tracer.shutdown()
 
 
 async def test_kafka_connectivity():
@@ -201,9 +515,9 @@ async def test_kafka_connectivity():
         if success:
             await log_callback("✅ Kafka connectivity test passed")
         else:
-            await log_callback("❌ Kafka connectivity test failed")
+            await log_callback("❌ Kafka connectivity test failed", "error")
     except Exception as e:
-        await log_callback(f"❌ Connectivity test error: {str(e)}")
+        await log_callback(f"❌ Connectivity test error: {str(e)}", "error")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,3 @@
+"""
+Benchmarks du backend pilot (à lancer depuis backend-pilot/ avec python -m benchmarks.<nom>)
+"""
@@ -0,0 +1,172 @@
+"""
+Auto-tuning des clients librdkafka : balaye les paramètres clés et mesure latence et débit
+
+Usage (depuis backend-pilot/) :
+    python -m benchmarks.autotune                         # broker mock librdkafka en process
+    python -m benchmarks.autotune --bootstrap localhost:9092   # broker jetable, ex. :
+        docker run -d --rm -p 9092:9092 apache/kafka:latest
+
+Chaque essai part des profils de config.py et ne change qu'un paramètre à la
+fois. La latence est mesurée de bout en bout (produce -> consume) sur un flux
+cadencé, le débit sur une rafale de messages de la taille d'une instruction.
+"""
+
+import argparse
+import json
+import threading
+import time
+import uuid
+
+from confluent_kafka import Consumer, KafkaException, Producer, TopicPartition
+
+from config import TUNING_PROFILES, get_consumer_config, get_producer_config
+
+# Payload représentatif d'une instruction du serveur de course
+PAYLOAD = json.dumps({
+    "id": "42",
+    "type": "instruction",
+    "action": "go_forward",
+    "target": "Avenue Alsace Lorraine",
+    "km_gain": 0.3,
+    "latitude": 45.1920,
+    "longitude": 5.7280,
+}).encode("utf-8")
+
+SWEEP = {
+    'producer': {
+        'linger.ms': [0, 5, 10, 50],
+        'batch.size': [16384, 131072, 1048576],
+        'compression.type': ['none', 'snappy', 'lz4', 'zstd'],
+        'acks': ['1', 'all'],
+    },
+    'consumer': {
+        'fetch.wait.max.ms': [10, 100, 500],
+        'fetch.min.bytes': [1, 65536],
+    },
+}
+
+
+def start_mock_cluster():
+    """Démarre un cluster mock librdkafka à un broker et retourne (handle, bootstrap)"""
+    handle = Producer({'test.mock.num.brokers': 1, 'log_level': 0})
+    broker = next(iter(handle.list_topics(timeout=10).brokers.values()))
+    return handle, f"{broker.host}:{broker.port}"
+
+
+def bench_client_configs(bootstrap, profile, client=None, key=None, value=None):
+    overrides = {'bootstrap.servers': bootstrap, 'security.protocol': 'PLAINTEXT'}
+    producer_conf = get_producer_config(profile, overrides)
+    consumer_conf = get_consumer_config(profile, dict(overrides, **{
+        'group.id': f"autotune-{uuid.uuid4().hex[:8]}",
+        'enable.auto.commit': False,
+    }))
+    if client == 'producer':
+        producer_conf[key] = value
+    elif client == 'consumer':
+        consumer_conf[key] = value
+    return producer_conf, consumer_conf
+
+
+def run_trial(producer_conf, consumer_conf, messages, interval):
+    """Produit `messages` messages (cadencés si `interval` > 0) et les consomme.
+
+    Returns:
+        (latences bout en bout en ms, débit en messages/s)
+    """
+    topic = f"autotune-{uuid.uuid4().hex[:8]}"
+    producer = Producer(producer_conf)
+    consumer = Consumer(consumer_conf)
+    consumer.assign([TopicPartition(topic, 0, 0)])
+
+    sent_at = {}
+    latencies = []
+    ready = threading.Event()
+    done = threading.Event()
+    received = [0, None]
+
+    def consume():
+        deadline = time.monotonic() + 60
+        while received[0] < messages and time.monotonic() < deadline:
+            for msg in consumer.consume(num_messages=1000, timeout=0.1):
+                if msg.error():
+                    continue
+                if msg.key() == b"warmup":
+                    ready.set()
+                    continue
+                now = time.perf_counter()
+                latencies.append((now - sent_at[int(msg.key())]) * 1000)
+                received[0] += 1
+                received[1] = now
+        done.set()
+
+    # Crée le topic et attend que le consumer soit connecté avant de démarrer le chrono
+    thread = threading.Thread(target=consume, daemon=True)
+    thread.start()
+    producer.produce(topic, value=b"warmup", key=b"warmup", partition=0)
+    producer.flush(10)
+    ready.wait(30)
+
+    started = time.perf_counter()
+    for index in range(messages):
+        while True:
+            try:
+                sent_at[index] = time.perf_counter()
+                producer.produce(topic, value=PAYLOAD, key=str(index).encode(), partition=0)
+                break
+            except BufferError:
+                producer.poll(0.01)
+        producer.poll(0)
+        if interval:
+            time.sleep(interval)
+    producer.flush(30)
+    done.wait(60)
+    consumer.close()
+
+    elapsed = (received[1] or time.perf_counter()) - started
+    return latencies, (len(latencies) / elapsed if elapsed > 0 else 0.0)
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bootstrap", help="broker à utiliser (par défaut : cluster mock en process)")
+    parser.add_argument("--latency-messages", type=int, default=300)
+    parser.add_argument("--interval-ms", type=float, default=2.0, help="cadence du flux de latence")
+    parser.add_argument("--throughput-messages", type=int, default=50000)
+    parser.add_argument("--profiles-only", action="store_true", help="ne compare que les profils nommés")
+    args = parser.parse_args()
+
+    mock = None
+    bootstrap = args.bootstrap
+    if not bootstrap:
+        try:
+            mock, bootstrap = start_mock_cluster()
+        except KafkaException as e:
+            parser.error(f"mock cluster unavailable ({e}), use --bootstrap")
+
+    trials = [(profile, None, None, None) for profile in TUNING_PROFILES]
+    if not args.profiles_only:
+        for client, keys in SWEEP.items():
+            for key, values in keys.items():
+                for value in values:
+                    trials.append(('balanced', client, key, value))
+
+    print(f"Broker: {bootstrap}{' (mock librdkafka)' if mock else ''}")
+    print(f"{'profil':<12} {'paramètre':<38} {'p50 ms':>8} {'p99 ms':>8} {'msg/s':>10}")
+    for profile, client, key, value in trials:
+        producer_conf, consumer_conf = bench_client_configs(bootstrap, profile, client, key, value)
+        latencies, _ = run_trial(producer_conf, consumer_conf, args.latency_messages, args.interval_ms / 1000)
+        _, throughput = run_trial(producer_conf, consumer_conf, args.throughput_messages, 0)
+        setting = f"{client}.{key}={value}" if client else "(profil)"
+        print(f"{profile:<12} {setting:<38} {percentile(latencies, 0.5):8.2f} "
+              f"{percentile(latencies, 0.99):8.2f} {throughput:10.0f}")
+
+
+if __name__ == "__main__":
+    main()
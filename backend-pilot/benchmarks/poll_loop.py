@@ -0,0 +1,121 @@
+"""
+Mesure du CPU au repos de la boucle de consommation et de la latence stop -> restart
+
+Usage (depuis backend-pilot/) :
+    python -m benchmarks.poll_loop --bootstrap localhost:9092 --topic bench_instructions
+
+Sans broker joignable la boucle reste au repos (poll sans message), ce qui
+est exactement le cas mesuré pour le CPU idle. Le benchmark utilise son
+propre group id et désactive la déduplication et l'enregistrement des
+courses : l'état persisté du pilote (dedup_state.bin, replays/) n'est pas touché.
+"""
+
+import argparse
+import asyncio
+import threading
+import time
+
+from confluent_kafka import Consumer, TopicPartition
+
+import kafka_service
+from config import GLOBAL_CONFIG
+from kafka_service import KafkaPilotService
+
+
+def measure_cpu(seconds: float) -> float:
+    """Pourcentage d'un cœur consommé par le process pendant `seconds`"""
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    time.sleep(seconds)
+    return 100.0 * (time.process_time() - cpu_start) / (time.monotonic() - wall_start)
+
+
+def measure_legacy_spin(consumer_conf: dict, topic: str, seconds: float) -> float:
+    """Référence : l'ancienne boucle qui repart immédiatement sur un message None"""
+    consumer = Consumer(consumer_conf)
+    consumer.assign([TopicPartition(topic, 0, 0)])
+    stop = threading.Event()
+
+    def spin():
+        while not stop.is_set():
+            msg = consumer.poll(0)
+            if msg is None:
+                continue
+
+    thread = threading.Thread(target=spin, daemon=True)
+    thread.start()
+    time.sleep(1.0)
+    cpu = measure_cpu(seconds)
+    stop.set()
+    thread.join()
+    consumer.close()
+    return cpu
+
+
+async def run(args):
+    kafka_service.INSTRUCTION_TOPIC = args.topic
+    # Lu par le constructeur du service : aucun fichier d'état du pilote n'est chargé ni écrit
+    GLOBAL_CONFIG.set('DEFAULT', 'dedup_enabled', 'false')
+    GLOBAL_CONFIG.set('DEFAULT', 'replay_enabled', 'false')
+    service = KafkaPilotService()
+    service.consumer_conf["bootstrap.servers"] = args.bootstrap
+    service.consumer_conf["group.id"] = args.group_id
+    service.log = lambda message, level="info": None
+
+    baseline = measure_cpu(args.seconds)
+
+    await service.start_consumption()
+    # Laisser le consumer entrer dans sa boucle de poll
+    await asyncio.sleep(args.warmup)
+    idle = await asyncio.to_thread(measure_cpu, args.seconds)
+
+    restarts = []
+    for _ in range(args.restarts):
+        started = time.perf_counter()
+        service.stop_consumption()
+        await service.wait_stopped()
+        stopped = time.perf_counter()
+        await service.start_consumption()
+        restarts.append((stopped - started, time.perf_counter() - started))
+        await asyncio.sleep(args.warmup)
+
+    service.stop_consumption()
+    await service.wait_stopped()
+
+    # Pire cas : stop (ou reset) juste après un démarrage, pendant l'initialisation du consumer
+    early_stops = []
+    for delay in args.early_stop_delays:
+        await service.start_consumption()
+        await asyncio.sleep(delay)
+        started = time.perf_counter()
+        service.stop_consumption()
+        await service.wait_stopped()
+        early_stops.append((delay, time.perf_counter() - started))
+
+    legacy = await asyncio.to_thread(measure_legacy_spin, service.consumer_conf, args.topic, args.seconds)
+
+    print(f"CPU process sans consumer     : {baseline:6.2f} %")
+    print(f"CPU idle boucle adaptative    : {idle:6.2f} % (poll_idle_timeout={service.poll_idle_timeout}s)")
+    print(f"CPU idle ancienne boucle poll(0): {legacy:6.2f} %")
+    for index, (stop_latency, restart_latency) in enumerate(restarts, 1):
+        print(f"Restart {index}: stop -> consumer fermé {stop_latency * 1000:7.1f} ms, "
+              f"stop -> nouveau consumer lancé {restart_latency * 1000:7.1f} ms")
+    for delay, stop_latency in early_stops:
+        print(f"Stop {delay * 1000:5.0f} ms après le démarrage: stop -> consumer fermé {stop_latency * 1000:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bootstrap", default="localhost:9092")
+    parser.add_argument("--topic", default="bench_instructions")
+    parser.add_argument("--group-id", default="bench-poll-loop")
+    parser.add_argument("--seconds", type=float, default=5.0, help="durée de chaque mesure CPU")
+    parser.add_argument("--warmup", type=float, default=1.0, help="attente après chaque démarrage du consumer")
+    parser.add_argument("--early-stop-delays", type=float, nargs="+", default=[0.0, 0.05, 0.2, 1.0],
+                        help="délais (s) entre un démarrage et un stop immédiat")
+    parser.add_argument("--restarts", type=int, default=3)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
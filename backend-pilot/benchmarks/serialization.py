@@ -0,0 +1,95 @@
+"""
+Coût de sérialisation par instruction : chemin historique (json + dicts) vs enveloppes pré-encodées
+
+Usage (depuis backend-pilot/) :
+    python -m benchmarks.serialization --iterations 20000
+
+Pour une instruction reçue, on mesure tout ce qui est encodage/décodage :
+décodage du message Kafka, payload du rejeu, message WebSocket
+"instruction", log de debug et corps du checkpoint. La validation pydantic
+est identique dans les deux chemins et n'est pas comptée.
+"""
+
+import argparse
+import json
+import timeit
+
+from kafka_service import Checkpoint, Instruction
+from serialization import ORJSON_AVAILABLE, Envelope, dumps, encode_model, loads
+
+GROUP_ID = "bench-group"
+
+MESSAGE = json.dumps({
+    "id": "42",
+    "type": "instruction",
+    "action": "turn_right",
+    "target": "Boulevard Edouard Rey",
+    "km_gain": 0.15,
+    "latitude": 45.1905,
+    "longitude": 5.7265,
+}).encode("utf-8")
+
+INSTRUCTION = Instruction(**json.loads(MESSAGE))
+
+INSTRUCTION_ENVELOPE = Envelope("instruction")
+LOG_ENVELOPE = Envelope("log", key="message", level="debug")
+CHECKPOINT_ENVELOPE = Envelope("checkpoint", group_id=GROUP_ID)
+
+
+def legacy_path():
+    """Chemin avant les enveloppes : dicts intermédiaires et json.dumps -> str -> UTF-8"""
+    data = json.loads(MESSAGE.decode("utf-8"))
+    instruction_data = INSTRUCTION.model_dump()
+    replay_payload = json.dumps(instruction_data).encode("utf-8")
+    ws_instruction = json.dumps({"type": "instruction", "data": instruction_data}).encode("utf-8")
+    ws_log = json.dumps({"type": "log", "level": "debug",
+                         "message": f"We got a message! {MESSAGE.decode('utf-8')}"}).encode("utf-8")
+    checkpoint = Checkpoint(type="checkpoint", step=INSTRUCTION.id, id=INSTRUCTION.id, group_id=GROUP_ID,
+                            km_travelled=12.5, event_action=None).model_dump_json().encode("utf-8")
+    return data, replay_payload, ws_instruction, ws_log, checkpoint
+
+
+def fast_path():
+    """Chemin actuel : encodage unique en bytes, inséré dans des en-têtes pré-encodés"""
+    data = loads(MESSAGE)
+    instruction_json = encode_model(INSTRUCTION)
+    replay_payload = instruction_json
+    ws_instruction = INSTRUCTION_ENVELOPE.wrap(instruction_json)
+    ws_log = LOG_ENVELOPE.wrap(dumps(f"We got a message! {MESSAGE.decode('utf-8')}"))
+    checkpoint = CHECKPOINT_ENVELOPE.merge({"step": INSTRUCTION.id, "id": INSTRUCTION.id,
+                                            "km_travelled": 12.5, "event_action": None})
+    return data, replay_payload, ws_instruction, ws_log, checkpoint
+
+
+def check_equivalent():
+    """Les deux chemins doivent produire les mêmes documents JSON"""
+    for legacy, fast in zip(legacy_path(), fast_path()):
+        if isinstance(legacy, bytes):
+            legacy, fast = json.loads(legacy), json.loads(fast)
+        assert legacy == fast, (legacy, fast)
+
+
+def measure(func, iterations: int, repeat: int) -> float:
+    """Meilleur temps par appel en microsecondes"""
+    return min(timeit.repeat(func, number=iterations, repeat=repeat)) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    check_equivalent()
+    legacy = measure(legacy_path, args.iterations, args.repeat)
+    fast = measure(fast_path, args.iterations, args.repeat)
+
+    print(f"orjson: {'yes' if ORJSON_AVAILABLE else 'no (json fallback)'}")
+    print(f"{'path':<10} {'µs/event':>10}")
+    print(f"{'legacy':<10} {legacy:>10.2f}")
+    print(f"{'fast':<10} {fast:>10.2f}")
+    print(f"speedup: {legacy / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
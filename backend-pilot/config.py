@@ -19,21 +19,76 @@ def load_config():
 GLOBAL_CONFIG = load_config()
 
 
-def get_consumer_config():
-    """Retourne la configuration du consumer Kafka pour le pilot"""
-    config = {
-        'bootstrap.servers': GLOBAL_CONFIG.get('DEFAULT', 'bootstrap_servers'),
-        'group.id': GLOBAL_CONFIG.get('DEFAULT', 'group_id_pilot'),
-        'auto.offset.reset': 'earliest',
-        'fetch.min.bytes': 1,
-        'session.timeout.ms': 30000,
-        'heartbeat.interval.ms': 3000,
-        'max.poll.interval.ms': 300000,
+# Profils de réglage des clients librdkafka, sélectionnés par `tuning_profile`
+# dans config.ini. "balanced" reprend les valeurs historiques du pilote.
+TUNING_PROFILES = {
+    'low-latency': {
+        'consumer': {
+            'fetch.min.bytes': 1,
+            'fetch.wait.max.ms': 10,
+        },
+        'producer': {
+            'acks': '1',
+            'linger.ms': 0,
+            'batch.size': 16384,
+            'compression.type': 'none',
+        },
+    },
+    'balanced': {
+        'consumer': {
+            'fetch.min.bytes': 1,
+            'fetch.wait.max.ms': 500,
+        },
+        'producer': {
+            'acks': 'all',
+            'linger.ms': 10,
+            'batch.size': 16384,
+            'compression.type': 'snappy',
+        },
+    },
+    'throughput': {
+        'consumer': {
+            'fetch.min.bytes': 65536,
+            'fetch.wait.max.ms': 500,
+        },
+        'producer': {
+            'acks': 'all',
+            'linger.ms': 50,
+            'batch.size': 262144,
+            'compression.type': 'lz4',
+        },
+    },
+}
+
+DEFAULT_TUNING_PROFILE = 'balanced'
+
+
+def get_tuning_profile():
+    """Retourne le nom du profil de réglage sélectionné dans config.ini"""
+    profile = GLOBAL_CONFIG.get('DEFAULT', 'tuning_profile', fallback=DEFAULT_TUNING_PROFILE)
+    if profile not in TUNING_PROFILES:
+        raise ValueError(f"Unknown tuning_profile '{profile}'. Expected one of: {list(TUNING_PROFILES)}")
+    return profile
+
+
+def get_env_overrides(client):
+    """Surcharges par clé depuis l'environnement.
+
+    PILOT_PRODUCER_LINGER_MS=5 surcharge `linger.ms` du producer,
+    PILOT_CONSUMER_FETCH_WAIT_MAX_MS=50 surcharge `fetch.wait.max.ms` du consumer.
+    """
+    prefix = f"PILOT_{client.upper()}_"
+    return {
+        name[len(prefix):].lower().replace('_', '.'): value
+        for name, value in os.environ.items()
+        if name.startswith(prefix)
     }
-    
-    # Ajouter la sécurité si configurée
+
+
+def get_security_config():
+    """Retourne la configuration de sécurité commune au consumer et au producer"""
     security_protocol = GLOBAL_CONFIG.get('DEFAULT', 'security_protocol', fallback='PLAINTEXT')
-    config['security.protocol'] = security_protocol
+    config = {'security.protocol': security_protocol}
     
     if security_protocol == 'SASL_SSL':
         config.update({
@@ -45,29 +100,44 @@ def get_consumer_config():
     return config
 
 
-def get_producer_config():
-    """Retourne la configuration du producer Kafka pour le pilot"""
+def get_consumer_config(profile=None, overrides=None):
+    """Retourne la configuration du consumer Kafka pour le pilot
+
+    Args:
+        profile: Nom du profil de réglage (par défaut celui de config.ini)
+        overrides: Clés librdkafka appliquées en dernier, après l'environnement
+    """
+    config = {
+        'bootstrap.servers': GLOBAL_CONFIG.get('DEFAULT', 'bootstrap_servers'),
+        'group.id': GLOBAL_CONFIG.get('DEFAULT', 'group_id_pilot'),
+        'auto.offset.reset': 'earliest',
+        'session.timeout.ms': 30000,
+        'heartbeat.interval.ms': 3000,
+        'max.poll.interval.ms': 300000,
+    }
+    config.update(TUNING_PROFILES[profile or get_tuning_profile()]['consumer'])
+    config.update(get_security_config())
+    config.update(get_env_overrides('consumer'))
+    config.update(overrides or {})
+    return config
+
+
+def get_producer_config(profile=None, overrides=None):
+    """Retourne la configuration du producer Kafka pour le pilot
+
+    Args:
+        profile: Nom du profil de réglage (par défaut celui de config.ini)
+        overrides: Clés librdkafka appliquées en dernier, après l'environnement
+    """
     config = {
         'bootstrap.servers': GLOBAL_CONFIG.get('DEFAULT', 'bootstrap_servers'),
-        'acks': 'all',
         'retries': 3,
         'retry.backoff.ms': 300,
-        'linger.ms': 10,
-        'batch.size': 16384,
-        'compression.type': 'snappy',
     }
-    
-    # Ajouter la sécurité si configurée
-    security_protocol = GLOBAL_CONFIG.get('DEFAULT', 'security_protocol', fallback='PLAINTEXT')
-    config['security.protocol'] = security_protocol
-    
-    if security_protocol == 'SASL_SSL':
-        config.update({
-            'sasl.username': GLOBAL_CONFIG.get('DEFAULT', 'sasl_username'),
-            'sasl.password': GLOBAL_CONFIG.get('DEFAULT', 'sasl_password'),
-            'sasl.mechanism': 'PLAIN',
-        })
-    
+    config.update(TUNING_PROFILES[profile or get_tuning_profile()]['producer'])
+    config.update(get_security_config())
+    config.update(get_env_overrides('producer'))
+    config.update(overrides or {})
     return config
 
 
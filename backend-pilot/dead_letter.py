@@ -0,0 +1,298 @@
+"""
+File de lettres mortes (DLQ) pour les instructions rejetées
+"""
+
+import base64
+import json
+import os
+import threading
+from collections import Counter, deque
+from typing import Callable, Dict, List, Optional
+
+from confluent_kafka import Producer
+
+from config import GLOBAL_CONFIG, get_producer_config
+
+
+class DeadLetter:
+    """Message rejeté en attente d'écriture dans la DLQ"""
+
+    __slots__ = ("reason", "detail", "topic", "partition", "offset", "timestamp", "key", "value", "headers")
+
+    def __init__(self, reason, detail, topic, partition, offset, timestamp, key, value, headers):
+        self.reason = reason
+        self.detail = detail
+        self.topic = topic
+        self.partition = partition
+        self.offset = offset
+        self.timestamp = timestamp
+        self.key = key
+        self.value = value
+        self.headers = headers
+
+    @classmethod
+    def from_message(cls, msg, reason: str, detail: str = ""):
+        """Construit une lettre morte à partir d'un message Kafka, sans le décoder"""
+        _, timestamp = msg.timestamp()
+        return cls(
+            reason=reason,
+            detail=detail,
+            topic=msg.topic(),
+            partition=msg.partition(),
+            offset=msg.offset(),
+            timestamp=timestamp,
+            key=msg.key(),
+            value=msg.value(),
+            headers=msg.headers() or [],
+        )
+
+    def dlq_headers(self):
+        """En-têtes d'origine complétés par le contexte du rejet"""
+        return list(self.headers) + [
+            ("dlq.reason", self.reason.encode()),
+            ("dlq.detail", self.detail.encode("utf-8", "replace")),
+            ("dlq.source.topic", str(self.topic).encode()),
+            ("dlq.source.partition", str(self.partition).encode()),
+            ("dlq.source.offset", str(self.offset).encode()),
+        ]
+
+    def to_json(self):
+        """Sérialise la lettre morte en une ligne JSON (payload et en-têtes en base64)"""
+        return json.dumps({
+            "reason": self.reason,
+            "detail": self.detail,
+            "topic": self.topic,
+            "partition": self.partition,
+            "offset": self.offset,
+            "timestamp": self.timestamp,
+            "key": _b64(self.key),
+            "value": _b64(self.value),
+            "headers": [[k, _b64(v)] for k, v in self.headers],
+        })
+
+
+def _b64(data):
+    if data is None:
+        return None
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return base64.b64encode(data).decode("ascii")
+
+
+class TopicSink:
+    """Écrit les lettres mortes dans un topic Kafka"""
+
+    def __init__(self, topic: str):
+        self.topic = topic
+        self.producer = Producer(get_producer_config())
+
+    def write(self, batch: List[DeadLetter]):
+        for letter in batch:
+            while True:
+                try:
+                    self.producer.produce(
+                        self.topic,
+                        key=letter.key,
+                        value=letter.value,
+                        headers=letter.dlq_headers(),
+                    )
+                    break
+                except BufferError:
+                    # File interne librdkafka pleine : laisser partir des messages
+                    self.producer.poll(0.1)
+            self.producer.poll(0)
+        self.producer.flush(timeout=5)
+
+    def close(self):
+        self.producer.flush(timeout=5)
+
+
+class RotatingFileSink:
+    """Écrit les lettres mortes en JSON lines dans un fichier local à rotation"""
+
+    def __init__(self, path: str, max_bytes: int, backup_count: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, batch: List[DeadLetter]):
+        self._file.write("".join(letter.to_json() + "\n" for letter in batch))
+        self._file.flush()
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        self._file.close()
+
+
+class DeadLetterQueue:
+    """Tampon borné de messages rejetés, vidé par lots dans un thread dédié.
+
+    `submit` est appelé depuis le thread consumer : il ne fait qu'un ajout
+    dans une deque et l'incrément d'un compteur. Toute la sérialisation et
+    les I/O (topic Kafka ou fichier) se font dans le thread d'écriture.
+    Quand le tampon est plein, les nouveaux rejets sont comptés puis ignorés.
+    """
+
+    def __init__(self, target: str = "file", topic: Optional[str] = None, path: str = "dead_letters.jsonl",
+                 max_bytes: int = 10 * 1024 * 1024, backup_count: int = 3, buffer_size: int = 10000,
+                 batch_size: int = 500, flush_interval: float = 1.0):
+        self.target = target
+        self.topic = topic
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.logger: Optional[Callable] = None
+
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.rejected_by_reason = Counter()
+        self.dropped = 0
+        self.written = 0
+        self.write_errors = 0
+
+    @classmethod
+    def from_config(cls):
+        """Construit la DLQ à partir de la section DEFAULT de config.ini"""
+        return cls(
+            target=GLOBAL_CONFIG.get('DEFAULT', 'dlq_target', fallback='file'),
+            topic=GLOBAL_CONFIG.get('DEFAULT', 'dlq_topic', fallback=None),
+            path=GLOBAL_CONFIG.get('DEFAULT', 'dlq_path', fallback='dead_letters.jsonl'),
+            max_bytes=GLOBAL_CONFIG.getint('DEFAULT', 'dlq_max_bytes', fallback=10 * 1024 * 1024),
+            backup_count=GLOBAL_CONFIG.getint('DEFAULT', 'dlq_backup_count', fallback=3),
+            buffer_size=GLOBAL_CONFIG.getint('DEFAULT', 'dlq_buffer_size', fallback=10000),
+            batch_size=GLOBAL_CONFIG.getint('DEFAULT', 'dlq_batch_size', fallback=500),
+            flush_interval=GLOBAL_CONFIG.getint('DEFAULT', 'dlq_flush_interval_ms', fallback=1000) / 1000.0,
+        )
+
+    def set_logger(self, logger_func):
+        """Configure la fonction de logging (appelée une fois par lot, jamais par message)"""
+        self.logger = logger_func
+
+    def start(self):
+        """Démarre le thread d'écriture s'il ne tourne pas déjà"""
+        if self.target == "none":
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="dead-letter-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, msg, reason: str, detail: str = ""):
+        """Enregistre un message rejeté (chemin critique : pas d'I/O ni de sérialisation)"""
+        with self._lock:
+            self.rejected_by_reason[reason] += 1
+            if self.target == "none":
+                return
+            if len(self._buffer) >= self.buffer_size:
+                self.dropped += 1
+                return
+            self._buffer.append(DeadLetter.from_message(msg, reason, detail))
+            pending = len(self._buffer)
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def _drain(self) -> List[DeadLetter]:
+        with self._lock:
+            count = min(len(self._buffer), self.batch_size)
+            return [self._buffer.popleft() for _ in range(count)]
+
+    def _open_sink(self):
+        if self.target == "topic":
+            if not self.topic:
+                raise ValueError("dlq_topic must be set when dlq_target = topic")
+            return TopicSink(self.topic)
+        return RotatingFileSink(self.path, self.max_bytes, self.backup_count)
+
+    def _run(self):
+        try:
+            sink = self._open_sink()
+        except Exception as e:
+            self._log(f"❌ Dead-letter sink unavailable: {str(e)}", "error")
+            return
+
+        try:
+            while True:
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                stopping = self._stopping.is_set()
+                written = 0
+                while True:
+                    batch = self._drain()
+                    if not batch:
+                        break
+                    try:
+                        sink.write(batch)
+                        written += len(batch)
+                    except Exception as e:
+                        self.write_errors += len(batch)
+                        self._log(f"❌ Dead-letter write failed: {str(e)}", "error")
+                if written:
+                    self.written += written
+                    self._log(f"🗑️ {written} rejected message(s) written to dead-letter {self.target}")
+                if stopping:
+                    break
+        finally:
+            try:
+                sink.close()
+            except Exception:
+                pass
+
+    def _log(self, message, level="info"):
+        if self.logger:
+            self.logger(message, level)
+        else:
+            print(message)
+
+    def close(self, timeout: float = 5.0):
+        """Vide le tampon et arrête le thread d'écriture"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def reset_counters(self):
+        """Remet à zéro les compteurs de rejets"""
+        with self._lock:
+            self.rejected_by_reason.clear()
+            self.dropped = 0
+            self.written = 0
+            self.write_errors = 0
+
+    def get_stats(self) -> Dict:
+        """Retourne les compteurs de rejets par raison et l'état du tampon"""
+        with self._lock:
+            return {
+                "target": self.target,
+                "rejected": sum(self.rejected_by_reason.values()),
+                "by_reason": dict(self.rejected_by_reason),
+                "pending": len(self._buffer),
+                "dropped": self.dropped,
+                "written": self.written,
+                "write_errors": self.write_errors,
+            }
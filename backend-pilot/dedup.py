@@ -0,0 +1,264 @@
+"""
+Déduplication des instructions redélivrées, en mémoire bornée
+"""
+
+import os
+import struct
+import zlib
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from config import GLOBAL_CONFIG
+from serialization import dumps, loads
+
+MAGIC = b"PLTDDP4\n"
+# génération courante, log2(bits), graine du groupe, count courant, count précédent
+STATE_HEADER = struct.Struct("<BBIII")
+# taille d'un bloc JSON (progression de la course, puis clés de la fenêtre)
+BLOCK_HEADER = struct.Struct("<I")
+
+# Empreintes sur 30 bits (entiers « petits » pour CPython) ; 0 marque une case vide
+FINGERPRINT_MASK = (1 << 30) - 1
+
+
+class InstructionDeduplicator:
+    """Filtre d'idempotence par (groupe, id d'instruction).
+
+    Les `window` dernières clés sont gardées exactement (anneau FIFO indexé
+    par un dict), testées en premier : une clé récente n'est jamais
+    confondue avec une autre. Les
+    clés qui en sortent sont archivées dans une table d'empreintes (famille
+    des filtres cuckoo) : le crc32 de la clé choisit la case, le crc32 de la
+    clé inversée donne une empreinte de 30 bits, rangée par sondage
+    linéaire. Un faux positif demande l'égalité exacte de 30 bits ; la
+    table reste peu remplie (`capacity` au plus la moitié des cases) et un
+    test lit en moyenne une case par génération.
+
+    La table a deux générations entrelacées case à case dans un seul
+    tableau ; la courante devient la précédente quand elle atteint
+    `capacity`, ce qui garde une mémoire fixe. Les hachages ont pour graine
+    le groupe, stables entre redémarrages contrairement à hash().
+
+    L'état est persisté avec la progression de la course (`progress`) : la
+    table, la fenêtre et les totaux qui en dépendent sont toujours
+    restaurés ensemble.
+    """
+
+    def __init__(self, group_id: str = "", window: int = 8192, bits_log2: int = 25,
+                 capacity: int = 100_000, path: str = None, enabled: bool = True):
+        if not 7 <= bits_log2 <= 27:
+            raise ValueError("bits_log2 must be between 7 and 27")
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        if not 0 < capacity <= 1 << (bits_log2 - 6):
+            raise ValueError("capacity must be positive and at most half of the 2^(bits_log2 - 5) slots")
+        self.window = window
+        self.bits_log2 = bits_log2
+        self.capacity = capacity
+        self.path = path
+        self.enabled = enabled
+        self._seed = zlib.crc32(group_id.encode("utf-8"))
+        self._mask = (1 << (bits_log2 - 5)) - 1
+        # Masque des index de words (les deux générations)
+        self._index_mask = (2 << (bits_log2 - 5)) - 1
+        # Fenêtre exacte : clé -> position dans l'anneau des (clé, case, empreinte)
+        self.recent: Dict[str, int] = {}
+        self._ring: List[Optional[tuple]] = [None] * window
+        self._ring_position = 0
+        # words[2 * case + génération] ; `generation` désigne la génération courante
+        self.words = self._new_table()
+        self.generation = 0
+        self.current_count = 0
+        self.previous_count = 0
+        self.duplicates = 0
+        self.progress: Dict = {}
+        if path and enabled:
+            self.load()
+
+    @classmethod
+    def from_config(cls, group_id: str):
+        """Construit le filtre à partir de la section DEFAULT de config.ini"""
+        return cls(
+            group_id=group_id,
+            window=GLOBAL_CONFIG.getint('DEFAULT', 'dedup_window', fallback=8192),
+            bits_log2=GLOBAL_CONFIG.getint('DEFAULT', 'dedup_table_bits_log2', fallback=25),
+            capacity=GLOBAL_CONFIG.getint('DEFAULT', 'dedup_table_capacity', fallback=100_000),
+            path=GLOBAL_CONFIG.get('DEFAULT', 'dedup_state_path', fallback='dedup_state.bin'),
+            enabled=GLOBAL_CONFIG.getboolean('DEFAULT', 'dedup_enabled', fallback=True),
+        )
+
+    def _new_table(self, data: bytes = None) -> array:
+        return array("I", data if data is not None else bytes(2 << (self.bits_log2 - 3)))
+
+    def key(self, instruction_id) -> str:
+        """Clé d'une instruction (le groupe est porté par la graine du hachage)"""
+        return instruction_id if isinstance(instruction_id, str) else str(instruction_id)
+
+    def _fingerprint(self, key: str, crc32=zlib.crc32) -> Tuple[int, int]:
+        """(case, empreinte) d'une clé (même calcul que `is_duplicate`)"""
+        data = key.encode()
+        return crc32(data, self._seed) & self._mask, crc32(data[::-1], self._seed) & FINGERPRINT_MASK or 1
+
+    def is_duplicate(self, key: str, crc32=zlib.crc32) -> bool:
+        """True si la clé a déjà été vue ; sinon la mémorise"""
+        recent = self.recent
+        if key in recent:
+            self.duplicates += 1
+            return True
+
+        # Empreinte déroulée ici (chemin critique du consumer), cf. `_fingerprint`
+        data = key.encode()
+        slot = crc32(data, self._seed) & self._mask
+        fingerprint = crc32(data[::-1], self._seed) & FINGERPRINT_MASK or 1
+        words = self.words
+        index = slot << 1
+        # Les deux générations d'une case sont voisines : une seule ligne de cache
+        first, second = words[index], words[index + 1]
+        if first == fingerprint or second == fingerprint:
+            self.duplicates += 1
+            return True
+        if (first or second) and self._probe(index, fingerprint):
+            self.duplicates += 1
+            return True
+
+        # Entrée dans la fenêtre ; la plus ancienne clé en sort vers la table
+        ring = self._ring
+        position = self._ring_position
+        oldest = ring[position]
+        ring[position] = (key, slot, fingerprint)
+        recent[key] = position
+        self._ring_position = position + 1 if position + 1 < self.window else 0
+        if oldest is not None:
+            del recent[oldest[0]]
+            if self.current_count >= self.capacity:
+                self._rotate()
+            index = (oldest[1] << 1) | self.generation
+            if words[index]:
+                self._archive(oldest[1], oldest[2])
+            else:
+                words[index] = oldest[2]
+                self.current_count += 1
+        return False
+
+    def _probe(self, index: int, fingerprint: int) -> bool:
+        """Suite du sondage linéaire dans chaque génération à partir de la case `index`"""
+        words = self.words
+        for generation in (0, 1):
+            position = index | generation
+            while words[position]:
+                if words[position] == fingerprint:
+                    return True
+                position = (position + 2) & self._index_mask
+        return False
+
+    def forget(self, key: str) -> bool:
+        """Retire une clé de la fenêtre exacte (instruction finalement rejetée)"""
+        position = self.recent.pop(key, None)
+        if position is None:
+            return False
+        self._ring[position] = None
+        return True
+
+    def _window_keys(self) -> List[str]:
+        """Clés de la fenêtre, de la plus ancienne à la plus récente"""
+        position = self._ring_position
+        return [entry[0] for entry in self._ring[position:] + self._ring[:position] if entry is not None]
+
+    def _archive(self, slot: int, fingerprint: int):
+        """Range l'empreinte d'une clé sortie de la fenêtre dans la génération courante"""
+        if self.current_count >= self.capacity:
+            self._rotate()
+        words = self.words
+        index = (slot << 1) | self.generation
+        while words[index]:
+            if words[index] == fingerprint:
+                return
+            index = (index + 2) & self._index_mask
+        words[index] = fingerprint
+        self.current_count += 1
+
+    def _rotate(self):
+        """La génération courante devient la précédente ; l'ancienne précédente est vidée"""
+        self.generation ^= 1
+        self.words[self.generation::2] = array("I", bytes(1 << (self.bits_log2 - 3)))
+        self.previous_count, self.current_count = self.current_count, 0
+
+    def clear(self):
+        """Oublie toutes les instructions vues et la progression (nouvelle course)"""
+        self.recent.clear()
+        self._ring = [None] * self.window
+        self._ring_position = 0
+        self.words = self._new_table()
+        self.generation = 0
+        self.current_count = self.previous_count = 0
+        self.duplicates = 0
+        self.progress = {}
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def save(self, progress: Optional[Dict] = None):
+        """Persiste la table, la fenêtre et la progression associée de manière atomique"""
+        if not self.path or not self.enabled:
+            return
+        if progress is not None:
+            self.progress = dict(progress)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(STATE_HEADER.pack(self.generation, self.bits_log2, self._seed,
+                                      self.current_count, self.previous_count))
+            f.write(self.words.tobytes())
+            for block in (dumps(self.progress), dumps(self._window_keys())):
+                f.write(BLOCK_HEADER.pack(len(block)))
+                f.write(block)
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> bool:
+        """Recharge l'état persisté s'il correspond aux paramètres courants"""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return False
+            header = f.read(STATE_HEADER.size)
+            if len(header) < STATE_HEADER.size:
+                return False
+            generation, bits_log2, seed, current_count, previous_count = STATE_HEADER.unpack(header)
+            if bits_log2 != self.bits_log2 or seed != self._seed:
+                print(f"⚠️ Ignoring dedup state {self.path}: table size or group changed")
+                return False
+            data = f.read(2 << (bits_log2 - 3))
+            if len(data) != 2 << (bits_log2 - 3):
+                return False
+            blocks = []
+            for _ in range(2):
+                length = f.read(BLOCK_HEADER.size)
+                if len(length) < BLOCK_HEADER.size:
+                    return False
+                blocks.append(f.read(BLOCK_HEADER.unpack(length)[0]))
+        self.words = self._new_table(data)
+        self.generation = generation
+        self.current_count, self.previous_count = current_count, previous_count
+        self.progress = loads(blocks[0]) if blocks[0] else {}
+        self.recent.clear()
+        self._ring = [None] * self.window
+        self._ring_position = 0
+        window_keys = loads(blocks[1]) if blocks[1] else []
+        # Fenêtre réduite depuis la sauvegarde : les clés les plus anciennes sont archivées
+        overflow = max(len(window_keys) - self.window, 0)
+        for key in window_keys[:overflow]:
+            self._archive(*self._fingerprint(key))
+        for key in window_keys[overflow:]:
+            self._ring[self._ring_position] = (key, *self._fingerprint(key))
+            self.recent[key] = self._ring_position
+            self._ring_position = (self._ring_position + 1) % self.window
+        return True
+
+    def get_stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "duplicates_dropped": self.duplicates,
+            "window": len(self.recent),
+            "archived": self.current_count + self.previous_count,
+            "memory_bytes": len(self.words) * self.words.itemsize,
+        }
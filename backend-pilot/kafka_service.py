@@ -13,9 +13,19 @@ from typing import Dict, List, Optional, Callable
 from confluent_kafka import Consumer, KafkaError, KafkaException, Producer
 from pydantic import BaseModel
 
+from dead_letter import DeadLetterQueue
+from dedup import InstructionDeduplicator
+from replay import ReplayRecorder
+from serialization import Envelope, JSONDecodeError, encode_model, loads
+from tracing import MessageTrace, MessageTracer
+
 from config import get_consumer_config, get_producer_config, GLOBAL_CONFIG, INSTRUCTION_TOPIC, CHECKPOINT_TOPIC
 
 
+# Niveaux des messages de log, du plus verbeux au plus grave
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
+
 class Instruction(BaseModel):
     """Modèle de validation pour une instruction"""
     id: str
@@ -28,7 +38,11 @@ class Instruction(BaseModel):
 
 
 class Checkpoint(BaseModel):
-    """Modèle de validation pour un checkpoint"""
+    """Modèle de validation pour un checkpoint
+
+    Les checkpoints sont encodés par `KafkaPilotService.send_checkpoint` à
+    partir d'un en-tête pré-sérialisé ; ce modèle en décrit le format.
+    """
     type: str
     step: str
     id: str
@@ -62,6 +76,8 @@ class KafkaPilotService:
         # Configuration consumer et producer depuis config.ini
         self.consumer_conf = get_consumer_config()
         self.producer_conf = get_producer_config()
+        # En-tête JSON constant des checkpoints de ce pilote, encodé une seule fois
+        self._checkpoint_envelope = Envelope("checkpoint", group_id=self.consumer_conf['group.id'])
         
         # Données du pilote
         self.instructions: List[Dict] = []
@@ -73,12 +89,39 @@ class KafkaPilotService:
         
         # État de consommation
         self.running = False
+        self._stop_event = threading.Event()
+        self._consumer_future: Optional[asyncio.Future] = None
+        self.consumer_thread_id: Optional[int] = None  # pour le profilage à la demande
+        self.poll_idle_timeout = GLOBAL_CONFIG.getint('DEFAULT', 'poll_idle_timeout_ms', fallback=250) / 1000.0
+        self.poll_batch_size = GLOBAL_CONFIG.getint('DEFAULT', 'poll_batch_size', fallback=100)
+        self.consumer_debug = GLOBAL_CONFIG.getboolean('DEFAULT', 'consumer_debug', fallback=False)
         self.ready_sent = False
         self.consumer = None
         self.producer = None
         
         # Callback pour notifier le frontend
         self.instruction_callback: Optional[Callable] = None
+        self.status_callback: Optional[Callable] = None
+        # Filtre des niveaux de log : les logs que personne n'écoute ne sont pas émis
+        self.log_filter: Optional[Callable[[int], bool]] = None
+        
+        # File de lettres mortes pour les instructions rejetées
+        self.dead_letters = DeadLetterQueue.from_config()
+        self.dead_letters.set_logger(self.log)
+        
+        # Traçage de la latence par étape (échantillonné, export OTLP vers otelcol)
+        self.tracer = MessageTracer.from_config()
+        
+        # Enregistrement des instructions traitées pour le rejeu des courses
+        self.replay = ReplayRecorder.from_config()
+        self._race_id: Optional[str] = None  # course reprise au prochain démarrage
+        
+        # Idempotence : les instructions redélivrées sont écartées avant validation.
+        # La partition est relue depuis l'offset 0 à chaque démarrage : les totaux
+        # sont restaurés avec le filtre, sinon les instructions écartées manqueraient.
+        self.deduplicator = InstructionDeduplicator.from_config(self.consumer_conf['group.id'])
+        self._dedup_clear_pending = False
+        self._restore_progress(self.deduplicator.progress)
         
         # Données de test pour simulation
         self.test_instructions = [
@@ -145,8 +188,18 @@ class KafkaPilotService:
         """Configure la fonction de logging"""
         self.logger = logger_func
 
-    def log(self, message):
+    def set_log_filter(self, log_filter):
+        """Configure le filtre appelé avec le niveau numérique d'un log (True = à émettre)"""
+        self.log_filter = log_filter
+
+    def wants_log(self, level: str) -> bool:
+        """True si un log de ce niveau a au moins un destinataire"""
+        return not self.logger or self.log_filter is None or self.log_filter(LOG_LEVELS[level])
+
+    def log(self, message, level: str = "info"):
         """Log un message via le logger configuré ou print par défaut"""
+        if not self.wants_log(level):
+            return
         timestamp = datetime.now().strftime("%H:%M:%S")
         formatted_message = f"[{timestamp}] {message}"
         
@@ -159,7 +212,7 @@ class KafkaPilotService:
             try:
                 loop = asyncio.get_running_loop()
                 # We're in the main thread
-                result = self.logger(formatted_message)
+                result = self.logger(formatted_message, level)
                 if asyncio.iscoroutine(result):
                     asyncio.create_task(result)
                 return
@@ -171,7 +224,7 @@ class KafkaPilotService:
             if self._main_loop and self._main_loop.is_running():
                 # Schedule the callback on the main loop
                 future = asyncio.run_coroutine_threadsafe(
-                    self.logger(formatted_message),
+                    self.logger(formatted_message, level),
                     self._main_loop
                 )
                 # Optional: wait for a short time to ensure it's scheduled
@@ -193,11 +246,26 @@ class KafkaPilotService:
         """Configure le callback pour notifier le frontend des nouvelles instructions"""
         self.instruction_callback = callback
 
+    def set_status_callback(self, callback):
+        """Configure le callback async appelé à chaque changement de statut"""
+        self.status_callback = callback
+
     def set_status(self, status):
         """Met à jour le statut global de manière thread-safe"""
         with self.status_lock:
             self.current_status = status
             self.log(f"🚁 Pilot Status updated: {status}")
+        self._notify_status()
+
+    def _notify_status(self):
+        """Planifie le callback de statut sur la boucle principale, sans attendre"""
+        if not self.status_callback:
+            return
+        try:
+            asyncio.get_running_loop().create_task(self.status_callback())
+        except RuntimeError:
+            if self._main_loop and self._main_loop.is_running():
+                asyncio.run_coroutine_threadsafe(self.status_callback(), self._main_loop)
 
     def get_status(self):
         """Récupère le statut global de manière thread-safe"""
@@ -222,7 +290,7 @@ class KafkaPilotService:
             if result == 0:
                 self.log("✅ TCP connection successful")
             else:
-                self.log(f"❌ TCP connection failed with error code: {result}")
+                self.log(f"❌ TCP connection failed with error code: {result}", level="error")
                 return False
             
             # Test 2: Test producer simple
@@ -231,7 +299,7 @@ class KafkaPilotService:
             
             def delivery_report(err, msg):
                 if err is not None:
-                    self.log(f"❌ Message delivery failed: {err}")
+                    self.log(f"❌ Message delivery failed: {err}", level="error")
                 else:
                     self.log(f"✅ Message delivered to {msg.topic()} [{msg.partition()}]")
             
@@ -253,7 +321,7 @@ class KafkaPilotService:
             if INSTRUCTION_TOPIC in metadata.topics:
                 self.log(f"✅ Topic {INSTRUCTION_TOPIC} found")
             else:
-                self.log(f"⚠️ Topic {INSTRUCTION_TOPIC} not found, but connection works")
+                self.log(f"⚠️ Topic {INSTRUCTION_TOPIC} not found, but connection works", level="warning")
             
             test_consumer.close()
             
@@ -261,13 +329,13 @@ class KafkaPilotService:
             return True
             
         except Exception as e:
-            self.log(f"❌ Kafka connectivity test failed: {str(e)}")
+            self.log(f"❌ Kafka connectivity test failed: {str(e)}", level="error")
             return False
 
     async def send_ready_checkpoint(self):
         """Envoie le checkpoint ready pour démarrer la course"""
         if self.ready_sent:
-            self.log("⚠️ Ready checkpoint already sent")
+            self.log("⚠️ Ready checkpoint already sent", level="warning")
             return False
             
         try:
@@ -282,7 +350,7 @@ class KafkaPilotService:
             
             def delivery_report(err, msg):
                 if err is not None:
-                    self.log(f"❌ Ready message delivery failed: {err}")
+                    self.log(f"❌ Ready message delivery failed: {err}", level="error")
                 else:
                     self.log(f"✅ Ready message delivered successfully")
                     print("✅ Ready message delivered successfully")
@@ -300,52 +368,102 @@ class KafkaPilotService:
             return True
             
         except Exception as e:
-            self.log(f"❌ Failed to send ready checkpoint: {str(e)}")
+            self.log(f"❌ Failed to send ready checkpoint: {str(e)}", level="error")
             return False
 
-    async def send_checkpoint(self, instruction_id: str, step: str, event_action: str = None):
-        """Envoie un checkpoint pour une instruction donnée"""
+    async def send_checkpoint(self, instruction_id: str, step: str, event_action: str = None,
+                              trace: Optional[MessageTrace] = None):
+        """Envoie un checkpoint pour une instruction donnée
+
+        Si l'instruction est tracée, le contexte W3C est joint en en-têtes et
+        la trace est clôturée à l'accusé de livraison.
+        """
         try:
             if not self.producer:
                 self.producer = Producer(self.producer_conf)
             
-            checkpoint = Checkpoint(
-                type="checkpoint",
-                step=step,
-                id=instruction_id,
-                group_id=self.consumer_conf['group.id'],
-                km_travelled=self.total_km_travelled,
-                event_action=event_action
-            )
+            # Corps du checkpoint (format Checkpoint) : en-tête pré-encodé + champs variables
+            checkpoint_body = self._checkpoint_envelope.merge({
+                "step": step,
+                "id": instruction_id,
+                "km_travelled": float(self.total_km_travelled),
+                "event_action": event_action,
+            })
             
             def delivery_report(err, msg):
+                if trace:
+                    trace.mark("checkpoint_delivered")
+                    self.tracer.finish(trace, error=str(err) if err is not None else None)
                 if err is not None:
-                    self.log(f"❌ Checkpoint delivery failed: {err}")
+                    self.log(f"❌ Checkpoint delivery failed: {err}", level="error")
                 else:
-                    self.log(f"✅ Checkpoint {instruction_id} delivered")
+                    self.log(f"✅ Checkpoint {instruction_id} delivered", level="debug")
             
+            if trace:
+                trace.mark("checkpoint_sent")
             self.producer.produce(
                 CHECKPOINT_TOPIC,
-                key=checkpoint.group_id,
-                value=checkpoint.model_dump_json(),
+                key=self.consumer_conf['group.id'],
+                value=checkpoint_body,
+                headers=self.tracer.outgoing_headers(trace),
                 callback=delivery_report
             )
             
             self.producer.flush(timeout=5)
             self.checkpoint_counter += 1
-            self.log(f"📍 Checkpoint sent for instruction {instruction_id}")
+            self.log(f"📍 Checkpoint sent for instruction {instruction_id}", level="debug")
             
         except Exception as e:
-            self.log(f"❌ Failed to send checkpoint: {str(e)}")
+            self.tracer.finish(trace, error=str(e))
+            self.log(f"❌ Failed to send checkpoint: {str(e)}", level="error")
+
+    async def _publish_instruction(self, instruction_json: bytes, instruction_id: str,
+                                   event_action: Optional[str], trace: Optional[MessageTrace] = None):
+        """Notifie le frontend puis envoie le checkpoint, dans cet ordre
+
+        Une seule coroutine : la trace, clôturée à l'accusé de livraison du
+        checkpoint, a toujours son étape "broadcasted" horodatée avant.
+        """
+        if self.instruction_callback:
+            try:
+                await self.instruction_callback(instruction_json)
+            except Exception as e:
+                self.log(f"❌ Failed to broadcast instruction {instruction_id}: {str(e)}", level="error")
+            if trace:
+                trace.mark("broadcasted")
+        await self.send_checkpoint(instruction_id, instruction_id, event_action, trace)
 
     async def start_consumption(self):
         """Démarre la consommation des messages Kafka ou la simulation"""
         if self.running:
-            self.log("⚠️ Consumption already running")
+            self.log("⚠️ Consumption already running", level="warning")
+            return
+            
+        # Ne jamais chevaucher un consumer précédent encore en cours de fermeture
+        if not await self.wait_stopped():
+            self.log("❌ Previous consumer did not stop, restart refused", level="error")
             return
             
+        # Le thread précédent a pu sauvegarder son état après un reset
+        if self._dedup_clear_pending:
+            self.deduplicator.clear()
+            self._dedup_clear_pending = False
+            
         self.running = True
+        # Événement propre à ce lancement : un ancien thread ne peut pas le réarmer
+        stop_event = threading.Event()
+        self._stop_event = stop_event
         self.set_status("DRIVING")
+        # Même course jusqu'au reset : la partition est relue depuis l'offset 0 et
+        # le filtre de déduplication écarte ce qui est déjà enregistré
+        resume = self._race_id if self.deduplicator.enabled else None
+        race_id = self.replay.start_race(resume)
+        if race_id:
+            self._race_id = race_id
+            if race_id == resume:
+                self.log(f"🎬 Resuming race {race_id} recording")
+            else:
+                self.log(f"🎬 Recording race {race_id} for replay")
         self.log("🎯 Starting instruction consumption...")
         
         # Run the blocking consumer in a thread executor
@@ -354,9 +472,11 @@ class KafkaPilotService:
             # Store the main loop for use in background threads
             self._main_loop = loop
             # Start the consumer loop in a background thread
-            loop.run_in_executor(None, self._consume_kafka_instructions_blocking, loop)
+            self._consumer_future = loop.run_in_executor(
+                None, self._consume_kafka_instructions_blocking, loop, stop_event
+            )
         except RuntimeError as e:
-            self.log(f"❌ Failed to start consumer: {e}")
+            self.log(f"❌ Failed to start consumer: {e}", level="error")
             self.running = False
             self.set_status("IDLE")
 
@@ -373,10 +493,12 @@ class KafkaPilotService:
                 
                 # Mettre à jour le kilométrage
                 self.total_km_travelled += instruction.km_gain
+                instruction_json = encode_model(instruction)
+                self.replay.record(instruction_json)
                 
                 # Notifier le frontend
                 if self.instruction_callback:
-                    await self.instruction_callback(instruction_data)
+                    await self.instruction_callback(instruction_json)
                 
                 # Envoyer le checkpoint 
                 # Pour les events, renvoyer l'action dans le checkpoint
@@ -391,38 +513,48 @@ class KafkaPilotService:
                 await asyncio.sleep(3)
                 
             except Exception as e:
-                self.log(f"❌ Error processing test instruction: {str(e)}")
+                self.log(f"❌ Error processing test instruction: {str(e)}", level="error")
                 break
         
         if self.test_instruction_index >= len(self.test_instructions):
             self.set_status("COMPLETED")
             self.log("🏁 All test instructions completed!")
 
-    def _validate_instruction(self, message_value):
-        """Validation globale d'un message d'instruction (format JSON + métier)"""
+    def _decode_message(self, message_value):
+        """Décodage d'un message d'instruction (format JSON)
+
+        Returns:
+            Un tuple (instruction_data, reason, detail) : le dict décodé et
+            (None, None), ou None et la raison du rejet avec son détail.
+        """
+        # 1. Validation format JSON
+        if not message_value:
+            return None, "empty", "Empty message received"
+        
+        try:
+            instruction_data = loads(message_value)
+        except (JSONDecodeError, UnicodeDecodeError) as e:
+            return None, "invalid_json", f"Invalid JSON format: {str(e)}"
+        
+        # 2. Validation structure de base
+        if not isinstance(instruction_data, dict):
+            return None, "not_object", "Message is not a JSON object"
+        return instruction_data, None, None
+
+    def _validate_instruction(self, instruction_data: dict):
+        """Validation métier d'une instruction décodée par `_decode_message`
+
+        Returns:
+            Un tuple (instruction, reason, detail) : l'instruction validée et
+            (None, None), ou None et la raison du rejet avec son détail.
+            Aucun log par message ici, les rejets partent dans la DLQ.
+        """
         try:
-            # 1. Validation format JSON
-            if not message_value:
-                self.log("⚠️ Empty message received")
-                return None
-            
-            try:
-                instruction_data = json.loads(message_value.decode('utf-8'))
-            except (json.JSONDecodeError, UnicodeDecodeError) as e:
-                self.log(f"⚠️ Invalid JSON format: {str(e)}")
-                return None
-            
-            # 2. Validation structure de base
-            if not isinstance(instruction_data, dict):
-                self.log("⚠️ Message is not a JSON object")
-                return None
-            
             # 3. Vérification des champs obligatoires
             required_fields = ['id', 'type', 'action', 'target', 'km_gain']
             for field in required_fields:
                 if field not in instruction_data:
-                    self.log(f"⚠️ Missing required field: {field}")
-                    return None
+                    return None, "missing_field", f"Missing required field: {field}"
             
             # 4. Validation métier des actions
             valid_actions = ['start', 'go_forward', 'turn_left', 'turn_right', 'arrival']
@@ -435,147 +567,260 @@ class KafkaPilotService:
             instruction_type = instruction_data.get('type')
             valid_types = ['instruction', 'event']
             if instruction_type not in valid_types:
-                self.log(f"⚠️ Invalid type '{instruction_type}'. Expected: {valid_types}")
-                return None
+                return None, "invalid_type", f"Invalid type '{instruction_type}'. Expected: {valid_types}"
             
             # 6. Validation avec Pydantic pour les types
             try:
                 instruction = Instruction(**instruction_data)
-                return instruction
+                return instruction, None, None
             except Exception as e:
-                self.log(f"⚠️ Pydantic validation failed: {str(e)}")
-                return None
+                return None, "schema", f"Pydantic validation failed: {str(e)}"
                 
         except Exception as e:
-            self.log(f"⚠️ Validation error: {str(e)}")
-            return None
+            return None, "validation_error", f"Validation error: {str(e)}"
 
-    def _consume_kafka_instructions_blocking(self, loop: asyncio.AbstractEventLoop):
+    def _consume_kafka_instructions_blocking(self, loop: asyncio.AbstractEventLoop, stop_event: threading.Event):
         """Blocking consumer loop to run in a thread executor.
 
         Args:
             loop: The asyncio event loop to schedule async callbacks on
+            stop_event: Arrêt de ce lancement uniquement (positionné par `stop_consumption`)
         """
+        thread_id = threading.get_ident()
+        self.consumer_thread_id = thread_id
+        consumer = None
         try:
             print(f"[DEBUG] Creating consumer with config: {self.consumer_conf}")
-            self.consumer = Consumer(self.consumer_conf)
+            consumer = Consumer(self.consumer_conf)
+            self.consumer = consumer
             
             # Force manual partition assignment instead of subscribe
             from confluent_kafka import TopicPartition
             tp = TopicPartition(INSTRUCTION_TOPIC, 0, 0)  # topic, partition, offset
             print(f"[DEBUG] Manually assigning partition: {tp}")
-            self.consumer.assign([tp])
+            consumer.assign([tp])
             
             # Debug: check assigned partitions
-            partitions = self.consumer.assignment()
+            partitions = consumer.assignment()
             print(f"[DEBUG] Assigned partitions: {partitions}")
             
             self.log(f"📡 Started consuming from topic: {INSTRUCTION_TOPIC} partition 0")
+            self.dead_letters.start()
             
-            # Debug: Check topic metadata
-            topics_metadata = self.consumer.list_topics(timeout=5)
-            if INSTRUCTION_TOPIC in topics_metadata.topics:
-                topic_meta = topics_metadata.topics[INSTRUCTION_TOPIC]
-                print(f"[DEBUG] Topic metadata: partitions={len(topic_meta.partitions)}")
-            else:
-                print(f"[DEBUG] Warning: Topic {INSTRUCTION_TOPIC} not found in metadata!")
+            # Debug: Check topic metadata. Appel bloquant (jusqu'à 5 s sans broker)
+            # pendant lequel un stop n'est pas vu : réservé au mode consumer_debug
+            if self.consumer_debug:
+                try:
+                    topics_metadata = consumer.list_topics(timeout=5)
+                    if INSTRUCTION_TOPIC in topics_metadata.topics:
+                        topic_meta = topics_metadata.topics[INSTRUCTION_TOPIC]
+                        print(f"[DEBUG] Topic metadata: partitions={len(topic_meta.partitions)}")
+                    else:
+                        print(f"[DEBUG] Warning: Topic {INSTRUCTION_TOPIC} not found in metadata!")
+                except KafkaException as e:
+                    print(f"[DEBUG] Topic metadata unavailable: {e}")
             
             poll_count = 0
-            last_debug = time.time()
+            message_count = 0
+            last_debug = time.monotonic()
             
-            while self.running:
+            # Boucle adaptative : long-poll quand le topic est vide (le thread
+            # dort dans librdkafka), puis drain non bloquant de ce qui est déjà
+            # en mémoire tant que les messages arrivent.
+            while not stop_event.is_set():
                 try:
-                    current_time = time.time()
-
-                    #TODO consommer un message (avec un timeout court)
+                    msg = consumer.poll(self.poll_idle_timeout)
+                    poll_count += 1
                     
-                    # Print debug info every 5 seconds
-                    if current_time - last_debug >= 5:
-                        position = self.consumer.position(self.consumer.assignment())
-                        print(f"[DEBUG] Consumer alive: polls={poll_count}, assigned={self.consumer.assignment()}, position={position}")
-                        last_debug = current_time
+                    if self.consumer_debug and time.monotonic() - last_debug >= 5:
+                        print(f"[DEBUG] Consumer alive: polls={poll_count}, messages={message_count}")
+                        last_debug = time.monotonic()
                     
                     if msg is None:
                         continue
-                    else: 
-                        self.log(f"We got a message! {msg.value().decode('utf-8')}")    
-
-                    if msg.error():
-                        if msg.error().code() == KafkaError._PARTITION_EOF:
-                            continue
-                        else:
-                            self.log(f"❌ Consumer error: {msg.error()}")
+                    
+                    batch = [msg]
+                    if self.poll_batch_size > 1:
+                        batch.extend(consumer.consume(num_messages=self.poll_batch_size - 1, timeout=0))
+                    message_count += len(batch)
+                    
+                    for msg in batch:
+                        if stop_event.is_set():
                             break
-
-                    # Process message in the consumer thread
-                    try:
-                        # Validation globale du message
-                        instruction = self._validate_instruction(msg.value())
-                        if instruction is None:
-                            self.log("⚠️ Invalid message, skipping...")
-                            self.consumer.commit(msg)  # Commit pour éviter le retraitement
-                            continue
-                        
-                        # Message valide - traitement normal
-                        self.log(f"✅ Valid instruction received: {instruction.id}")
-                        
-                        # Incrémenter le compteur de messages consommés
-                        self.instruction_counter += 1
-                        
-                        # Update stats
-                        self.total_km_travelled += instruction.km_gain
-                        
-                        # Préparer les données pour le callback
-                        instruction_data = instruction.model_dump()
-                        
-                        # Schedule async callbacks on the event loop
-                        if self.instruction_callback:
-                            asyncio.run_coroutine_threadsafe(
-                                self.instruction_callback(instruction_data), 
-                                loop
-                            )
-                        
-                        # Schedule checkpoint send on the event loop
-                        # Pour les instructions de type events, renvoyer l'action dans le checkpoint
-                        #TODO récupérer l'action de l'event
-                        asyncio.run_coroutine_threadsafe(
-                            #TODO : envoyer le checkpoint
-                            loop
-                        )
-                        
-                        # Commit can happen in this thread
-                        self.consumer.commit(msg)
-                        
-                        self.log(f"📍 Processed instruction {instruction.id}: {instruction.action}")
-                        
-                    except Exception as e:
-                        self.log(f"❌ Error processing message: {str(e)}")
-                        # Still commit to avoid reprocessing invalid messages
+                        # Une erreur sur un message ne doit pas perdre le reste du lot
                         try:
-                            self.consumer.commit(msg)
-                        except:
-                            pass
+                            if not self._handle_message(msg, loop, consumer):
+                                stop_event.set()
+                                break
+                        except Exception as e:
+                            self.log(f"❌ Error handling message at offset {msg.offset()}: {str(e)}", level="error")
                         
                 except Exception as e:
-                    self.log(f"❌ Consumer loop error: {str(e)}")
-                    # Small sleep to avoid tight error loop
-                    time.sleep(0.5)
+                    self.log(f"❌ Consumer loop error: {str(e)}", level="error")
+                    # Small sleep to avoid tight error loop (interrompu par un stop)
+                    stop_event.wait(0.5)
                     
         except Exception as e:
-            self.log(f"❌ Fatal consumer error: {str(e)}")
+            self.log(f"❌ Fatal consumer error: {str(e)}", level="error")
         finally:
-            if self.consumer:
+            if consumer is not None:
                 try:
-                    self.consumer.close()
+                    consumer.close()
                 except:
                     pass
+                # Ne libérer que l'état de ce lancement
+                if self.consumer is consumer:
+                    self.consumer = None
+            try:
+                self.deduplicator.save(self._progress())
+            except OSError as e:
+                self.log(f"⚠️ Could not save dedup state: {e}", level="warning")
+            if self.consumer_thread_id == thread_id:
+                self.consumer_thread_id = None
+            # Arrêt sur erreur fatale (aucun stop demandé) : le service repasse
+            # IDLE et peut être relancé ; la course reprendra au prochain démarrage
+            if self._stop_event is stop_event and self.running:
+                self.running = False
+                self.replay.close()
+                self.set_status("IDLE")
+                self.log("⚠️ Consumer stopped after a fatal error, service back to IDLE", level="warning")
+
+    def _progress(self) -> Dict:
+        """Totaux de la course, persistés avec l'état de déduplication"""
+        return {
+            "total_km_travelled": self.total_km_travelled,
+            "instruction_counter": self.instruction_counter,
+            "checkpoint_counter": self.checkpoint_counter,
+            "race_id": self._race_id,
+        }
+
+    def _restore_progress(self, progress: Dict):
+        if not progress:
+            return
+        self.total_km_travelled = float(progress.get("total_km_travelled", 0.0))
+        self.instruction_counter = int(progress.get("instruction_counter", 0))
+        self.checkpoint_counter = int(progress.get("checkpoint_counter", 0))
+        self._race_id = progress.get("race_id")
+        self.log(f"♻️ Restored race progress: {self.total_km_travelled:.2f} km, "
+                 f"{self.instruction_counter} instruction(s)")
+
+    def _handle_message(self, msg, loop: asyncio.AbstractEventLoop, consumer) -> bool:
+        """Traite un message dans le thread consumer.
+
+        Les commits passent par `consumer`, celui du lancement qui a lu le message.
+
+        Returns:
+            False si l'erreur consumer est fatale et que la boucle doit s'arrêter
+        """
+        error = msg.error()
+        if error:
+            if error.code() == KafkaError._PARTITION_EOF:
+                return True
+            else:
+                self.log(f"❌ Consumer error: {error}", level="error")
+                return False
+
+        value = msg.value()
+        if self.wants_log("debug"):
+            text = value.decode('utf-8', 'replace') if value is not None else "<tombstone>"
+            self.log(f"We got a message! {text}", level="debug")
+
+        # Process message in the consumer thread
+        dedup_key = None
+        try:
+            instruction_data, reason, detail = self._decode_message(value)
+            
+            # Instruction déjà traitée (redélivrance) : ni validation ni diffusion
+            if instruction_data is not None and self.deduplicator.enabled and 'id' in instruction_data:
+                dedup_key = self.deduplicator.key(instruction_data['id'])
+                if self.deduplicator.is_duplicate(dedup_key):
+                    consumer.commit(msg, asynchronous=True)
+                    return True
+            
+            # Ouvre la trace si le message est échantillonné (None sinon)
+            trace = self.tracer.start(msg)
+            
+            # Validation globale du message
+            instruction = None
+            if instruction_data is not None:
+                instruction, reason, detail = self._validate_instruction(instruction_data)
+            if trace:
+                trace.mark("validated")
+            if instruction is None:
+                if dedup_key is not None:
+                    self.deduplicator.forget(dedup_key)
+                self.tracer.finish(trace, error=reason)
+                # Rejet bufferisé dans la DLQ, commit asynchrone pour éviter le retraitement
+                self.dead_letters.submit(msg, reason, detail)
+                consumer.commit(msg, asynchronous=True)
+                return True
+            
+            # Message valide - traitement normal
+            self.log(f"✅ Valid instruction received: {instruction.id}", level="debug")
+            
+            # Incrémenter le compteur de messages consommés
+            self.instruction_counter += 1
+            
+            # Update stats
+            self.total_km_travelled += instruction.km_gain
+            
+            # Encodage unique de l'instruction validée, réutilisé par le rejeu et le frontend
+            instruction_json = encode_model(instruction)
+            self.replay.record(instruction_json)
+            
+            # Schedule frontend broadcast then checkpoint send on the event loop
+            if trace:
+                trace.instruction_id = instruction.id
+            # Pour les instructions de type events, renvoyer l'action dans le checkpoint
+            event_action = instruction.action if instruction.type == "event" else None
+            asyncio.run_coroutine_threadsafe(
+                self._publish_instruction(instruction_json, instruction.id, event_action, trace),
+                loop
+            )
+            
+            # Commit can happen in this thread
+            consumer.commit(msg)
+            
+            self.log(f"📍 Processed instruction {instruction.id}: {instruction.action}", level="debug")
+            
+        except Exception as e:
+            self.log(f"❌ Error processing message: {str(e)}", level="error")
+            if dedup_key is not None:
+                self.deduplicator.forget(dedup_key)
+            self.dead_letters.submit(msg, "processing_error", str(e))
+            # Still commit to avoid reprocessing invalid messages
+            try:
+                consumer.commit(msg, asynchronous=True)
+            except:
+                pass
+        return True
 
     def stop_consumption(self):
-        """Arrête la consommation des messages"""
+        """Arrête la consommation des messages
+
+        Réveille le thread consumer via l'événement d'arrêt ; utiliser
+        `wait_stopped` pour attendre la fermeture effective du consumer.
+        """
         self.running = False
+        self._stop_event.set()
+        self.replay.close()
         self.set_status("IDLE")
         self.log("⏹️ Consumption stopped")
 
+    async def wait_stopped(self, timeout: float = 10.0) -> bool:
+        """Attend que le thread consumer ait fermé le consumer Kafka"""
+        future = self._consumer_future
+        if future is None or future.done():
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.log(f"⚠️ Consumer still closing after {timeout}s", level="warning")
+            return False
+        except Exception:
+            return True
+
     def reset(self):
         """Remet à zéro l'état du service"""
         self.stop_consumption()
@@ -587,6 +832,13 @@ class KafkaPilotService:
         self.instructions.clear()
         self.checkpoints.clear()
         self.pending_commits.clear()
+        self.dead_letters.reset_counters()
+        # Nouvelle course : le prochain démarrage ouvre un nouvel enregistrement
+        self.replay.end_race()
+        self._race_id = None
+        # Nouvelle course : les mêmes ids d'instruction redeviennent valides
+        self.deduplicator.clear()
+        self._dedup_clear_pending = True
         self.set_status("IDLE")
         self.log("🔄 Service reset completed")
 
@@ -597,5 +849,7 @@ class KafkaPilotService:
             "ready_sent": self.ready_sent,
             "total_km_travelled": self.total_km_travelled,
             "instructions_processed": self.checkpoint_counter,
-            "total_instructions": self.instruction_counter
+            "total_instructions": self.instruction_counter,
+            "dead_letters": self.dead_letters.get_stats(),
+            "dedup": self.deduplicator.get_stats()
         }
\ No newline at end of file
@@ -0,0 +1,284 @@
+"""
+Classement en continu des pilotes à partir du topic des checkpoints
+"""
+
+import asyncio
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from confluent_kafka import Consumer, KafkaError
+
+from config import CHECKPOINT_TOPIC, GLOBAL_CONFIG, get_consumer_config
+from serialization import loads
+
+
+class _IndexedHeap:
+    """Tas binaire indexé par group_id, avec mise à jour et retrait en O(log n).
+
+    `sign` vaut 1 pour un tas min sur les km, -1 pour un tas max.
+    """
+
+    __slots__ = ("sign", "items", "positions")
+
+    def __init__(self, sign: int):
+        self.sign = sign
+        self.items: List[list] = []  # [clé, group_id, km]
+        self.positions: Dict[str, int] = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, group_id):
+        return group_id in self.positions
+
+    def peek_km(self) -> float:
+        return self.items[0][2]
+
+    def push(self, group_id: str, km: float):
+        self.items.append([self.sign * km, group_id, km])
+        self.positions[group_id] = len(self.items) - 1
+        self._sift_up(len(self.items) - 1)
+
+    def update(self, group_id: str, km: float):
+        position = self.positions[group_id]
+        entry = self.items[position]
+        old_key = entry[0]
+        entry[0], entry[2] = self.sign * km, km
+        if entry[0] < old_key:
+            self._sift_up(position)
+        else:
+            self._sift_down(position)
+
+    def pop(self):
+        """Retire la racine et retourne (group_id, km)"""
+        return self.remove(self.items[0][1])
+
+    def remove(self, group_id: str):
+        position = self.positions.pop(group_id)
+        entry = self.items[position]
+        last = self.items.pop()
+        if position < len(self.items):
+            self.items[position] = last
+            self.positions[last[1]] = position
+            self._sift_up(position)
+            self._sift_down(self.positions[last[1]])
+        return entry[1], entry[2]
+
+    def entries(self):
+        return [(group_id, km) for _, group_id, km in self.items]
+
+    def _less(self, i, j):
+        a, b = self.items[i], self.items[j]
+        return (a[0], a[1]) < (b[0], b[1])
+
+    def _swap(self, i, j):
+        items = self.items
+        items[i], items[j] = items[j], items[i]
+        self.positions[items[i][1]] = i
+        self.positions[items[j][1]] = j
+
+    def _sift_up(self, position):
+        while position > 0:
+            parent = (position - 1) >> 1
+            if not self._less(position, parent):
+                break
+            self._swap(position, parent)
+            position = parent
+
+    def _sift_down(self, position):
+        size = len(self.items)
+        while True:
+            smallest = position
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < size and self._less(child, smallest):
+                    smallest = child
+            if smallest == position:
+                return
+            self._swap(position, smallest)
+            position = smallest
+
+
+class Leaderboard:
+    """Classement top-K incrémental.
+
+    Le dernier km connu de chaque groupe est gardé dans un dict. Les K
+    meilleurs sont dans un tas min (`top`, racine = K-ième), les autres
+    dans un tas max (`rest`, racine = meilleur hors top). Une mise à jour
+    coûte O(log n) et au plus un échange entre les deux tas ; seul le
+    top-K (K petit) est trié à la lecture.
+    """
+
+    def __init__(self, size: int = 10):
+        self.size = size
+        self.latest: Dict[str, float] = {}
+        self.top = _IndexedHeap(1)
+        self.rest = _IndexedHeap(-1)
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.updates = 0
+        self._published: Dict[str, int] = {}
+
+    def update(self, group_id: str, km: float) -> bool:
+        """Enregistre le dernier km d'un groupe ; True si le top-K a pu changer"""
+        with self.lock:
+            previous = self.latest.get(group_id)
+            if previous == km:
+                return False
+            self.latest[group_id] = km
+            self.updates += 1
+
+            if group_id in self.top:
+                self.top.update(group_id, km)
+            elif group_id in self.rest:
+                self.rest.update(group_id, km)
+            elif len(self.top) < self.size:
+                self.top.push(group_id, km)
+            else:
+                self.rest.push(group_id, km)
+
+            # Échange si le meilleur hors top dépasse le K-ième (une seule clé a bougé)
+            if self.top and self.rest and self.rest.peek_km() > self.top.peek_km():
+                demoted, demoted_km = self.top.pop()
+                promoted, promoted_km = self.rest.pop()
+                self.top.push(promoted, promoted_km)
+                self.rest.push(demoted, demoted_km)
+
+            changed = group_id in self.top or group_id in self._published
+            self.dirty = self.dirty or changed
+            return changed
+
+    def ranking(self, limit: Optional[int] = None) -> List[Dict]:
+        """Top-K trié par km décroissant"""
+        with self.lock:
+            entries = self.top.entries()
+        entries.sort(key=lambda entry: (-entry[1], entry[0]))
+        if limit is not None:
+            entries = entries[:limit]
+        return [
+            {"rank": rank, "group_id": group_id, "km_travelled": km}
+            for rank, (group_id, km) in enumerate(entries, 1)
+        ]
+
+    def rank_changes(self) -> Optional[Dict]:
+        """Changements de rang depuis la dernière publication, ou None si rien n'a bougé"""
+        if not self.dirty:
+            return None
+        self.dirty = False
+        ranking = self.ranking()
+        current = {entry["group_id"]: entry["rank"] for entry in ranking}
+        changes = [
+            {"group_id": group_id, "rank": rank, "previous_rank": self._published.get(group_id)}
+            for group_id, rank in current.items()
+            if self._published.get(group_id) != rank
+        ]
+        changes.extend(
+            {"group_id": group_id, "rank": None, "previous_rank": rank}
+            for group_id, rank in self._published.items()
+            if group_id not in current
+        )
+        self._published = current
+        if not changes:
+            return None
+        return {"top": ranking, "changes": changes}
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {"groups": len(self.latest), "updates": self.updates, "size": self.size}
+
+
+class LeaderboardService:
+    """Consomme le topic des checkpoints dans un thread et alimente le classement.
+
+    Les changements de rang sont regroupés et publiés au plus une fois par
+    `push_interval` via le callback, sur la boucle asyncio principale.
+    """
+
+    def __init__(self, size: int = 10, push_interval: float = 0.25, enabled: bool = True):
+        self.enabled = enabled
+        self.leaderboard = Leaderboard(size)
+        self.push_interval = push_interval
+        self.consumer_conf = get_consumer_config(overrides={
+            'group.id': f"{GLOBAL_CONFIG.get('DEFAULT', 'group_id_pilot')}-leaderboard",
+            # Pas de commit : l'état est en mémoire, il est reconstruit depuis le début du topic
+            'enable.auto.commit': False,
+        })
+        self.callback: Optional[Callable] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @classmethod
+    def from_config(cls):
+        """Construit le service à partir de la section DEFAULT de config.ini"""
+        return cls(
+            size=GLOBAL_CONFIG.getint('DEFAULT', 'leaderboard_size', fallback=10),
+            push_interval=GLOBAL_CONFIG.getint('DEFAULT', 'leaderboard_push_interval_ms', fallback=250) / 1000.0,
+            enabled=GLOBAL_CONFIG.getboolean('DEFAULT', 'leaderboard_enabled', fallback=True),
+        )
+
+    def set_callback(self, callback):
+        """Configure le callback async appelé avec les changements de rang"""
+        self.callback = callback
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Démarre le thread consumer du classement"""
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._loop = loop
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._consume_checkpoints, name="leaderboard", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Arrête le thread consumer du classement"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def apply(self, value: bytes):
+        """Applique un message du topic des checkpoints au classement"""
+        try:
+            checkpoint = loads(value)
+        except (TypeError, ValueError):
+            return
+        if not isinstance(checkpoint, dict) or checkpoint.get("type") != "checkpoint":
+            return
+        group_id = checkpoint.get("group_id")
+        km = checkpoint.get("km_travelled")
+        if isinstance(group_id, str) and isinstance(km, (int, float)):
+            self.leaderboard.update(group_id, float(km))
+
+    def _consume_checkpoints(self):
+        consumer = None
+        try:
+            consumer = Consumer(self.consumer_conf)
+            consumer.subscribe([CHECKPOINT_TOPIC])
+            last_push = time.monotonic()
+            while not self._stop_event.is_set():
+                msg = consumer.poll(min(self.push_interval, 0.25))
+                if msg is not None:
+                    for msg in [msg] + consumer.consume(num_messages=500, timeout=0):
+                        if msg.error():
+                            if msg.error().code() != KafkaError._PARTITION_EOF:
+                                print(f"[leaderboard] Consumer error: {msg.error()}")
+                            continue
+                        self.apply(msg.value())
+                if time.monotonic() - last_push >= self.push_interval:
+                    last_push = time.monotonic()
+                    self._publish()
+        except Exception as e:
+            print(f"[leaderboard] Fatal consumer error: {e}")
+        finally:
+            if consumer:
+                try:
+                    consumer.close()
+                except Exception:
+                    pass
+
+    def _publish(self):
+        if not self.callback or not self._loop or not self._loop.is_running():
+            return
+        update = self.leaderboard.rank_changes()
+        if update is not None:
+            asyncio.run_coroutine_threadsafe(self.callback(update), self._loop)
@@ -0,0 +1,222 @@
+"""
+Profilage à la demande du processus : échantillonnage CPU et suivi des allocations
+"""
+
+import linecache
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Optional
+
+from config import GLOBAL_CONFIG
+
+# Modules dont on remonte les sites d'allocation
+ALLOCATION_MODULES = ("kafka_service.py", "app.py")
+
+
+class SamplingProfiler:
+    """Profil CPU par échantillonnage de piles, borné dans le temps.
+
+    Un thread dédié relève périodiquement la pile des threads suivis
+    (boucle asyncio, thread consumer) via `sys._current_frames()`. Aucun
+    hook n'est installé dans l'interpréteur : hors profilage il n'y a ni
+    thread ni coût. Le résultat est au format « collapsed stacks »
+    (`thread;f1 (fichier:ligne);f2 (...) N`) lisible par flamegraph.pl,
+    speedscope ou inferno.
+    """
+
+    def __init__(self, interval: float = 0.005, max_duration: float = 60.0):
+        self.interval = interval
+        self.max_duration = max_duration
+        self.threads: Dict[int, str] = {}
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._labels: Dict[object, str] = {}
+
+    @classmethod
+    def from_config(cls):
+        """Construit le profileur à partir de la section DEFAULT de config.ini"""
+        return cls(
+            interval=GLOBAL_CONFIG.getint('DEFAULT', 'profiling_interval_ms', fallback=5) / 1000.0,
+            max_duration=GLOBAL_CONFIG.getfloat('DEFAULT', 'profiling_max_duration_s', fallback=60.0),
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, threads: Dict[int, str], duration: float) -> bool:
+        """Démarre un profil de `duration` secondes (plafonné) sur les threads {ident: nom}"""
+        if self.running:
+            return False
+        self.threads = dict(threads)
+        self.samples = Counter()
+        self.sample_count = 0
+        self.started_at = time.time()
+        self.stopped_at = None
+        self._stop_event.clear()
+        duration = min(max(duration, self.interval), self.max_duration)
+        self._thread = threading.Thread(target=self._sample, args=(duration,), name="profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """Arrête le profil en cours (les échantillons restent disponibles)"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(1.0)
+        self._thread = None
+
+    def _sample(self, duration: float):
+        deadline = time.monotonic() + duration
+        current_frames = sys._current_frames
+        samples = self.samples
+        while not self._stop_event.wait(self.interval) and time.monotonic() < deadline:
+            frames = current_frames()
+            for ident, name in self.threads.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = [name]
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                samples[tuple(stack)] += 1
+            self.sample_count += 1
+            del frames
+        self.stopped_at = time.time()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def collapsed(self) -> str:
+        """Piles agrégées au format collapsed, racine en premier"""
+        lines = []
+        for stack, count in self.samples.most_common():
+            frames = [stack[0]] + [self._label(code) for code in reversed(stack[1:])]
+            lines.append(f"{';'.join(frames)} {count}")
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def get_stats(self) -> Dict:
+        return {
+            "running": self.running,
+            "threads": sorted(self.threads.values()),
+            "interval_ms": self.interval * 1000,
+            "samples": self.sample_count,
+            "stacks": len(self.samples),
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+        }
+
+
+class AllocationTracker:
+    """Différence d'allocations mémoire entre deux instants avec tracemalloc.
+
+    `start` active tracemalloc et prend l'instantané de référence ; `diff`
+    compare l'état courant à cette référence. Les piles sont conservées
+    sur `frames` niveaux : une allocation faite dans une dépendance
+    (pydantic, json, confluent_kafka...) est attribuée à la frame la plus
+    proche qui appartient à un module suivi. tracemalloc n'est actif
+    qu'entre `start` et `stop`.
+    """
+
+    def __init__(self, frames: int = 25, modules=ALLOCATION_MODULES):
+        self.frames = frames
+        self.modules = modules
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self.baseline_at: Optional[float] = None
+
+    @classmethod
+    def from_config(cls):
+        """Construit le suivi à partir de la section DEFAULT de config.ini"""
+        return cls(frames=GLOBAL_CONFIG.getint('DEFAULT', 'tracemalloc_frames', fallback=25))
+
+    @property
+    def running(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self):
+        """Active tracemalloc (si besoin) et prend l'instantané de référence"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.baseline = self._snapshot()
+        self.baseline_at = time.time()
+
+    def stop(self):
+        """Désactive tracemalloc et oublie la référence"""
+        self.baseline = None
+        self.baseline_at = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(True, f"*{module}", all_frames=True) for module in self.modules]
+        )
+
+    def _site(self, traceback: tracemalloc.Traceback) -> Optional[tracemalloc.Frame]:
+        """Frame d'un module suivi la plus proche de l'allocation"""
+        # Les frames vont de la plus ancienne à la plus récente
+        for frame in reversed(traceback):
+            if os.path.basename(frame.filename) in self.modules:
+                return frame
+        return None
+
+    def _sites(self, snapshot: tracemalloc.Snapshot) -> Dict[tuple, List[int]]:
+        """{(fichier, ligne): [taille, nombre de blocs]} par site d'allocation"""
+        sites: Dict[tuple, List[int]] = {}
+        for stat in snapshot.statistics("traceback"):
+            frame = self._site(stat.traceback)
+            if frame is None:
+                continue
+            site = sites.setdefault((frame.filename, frame.lineno), [0, 0])
+            site[0] += stat.size
+            site[1] += stat.count
+        return sites
+
+    def diff(self, limit: int = 20, rebase: bool = False) -> Optional[List[Dict]]:
+        """Top des sites d'allocation depuis la référence, ou None si le suivi est inactif"""
+        if self.baseline is None or not tracemalloc.is_tracing():
+            return None
+        snapshot = self._snapshot()
+        current = self._sites(snapshot)
+        previous = self._sites(self.baseline)
+        if rebase:
+            self.baseline = snapshot
+            self.baseline_at = time.time()
+        top = []
+        for filename, lineno in current.keys() | previous.keys():
+            size, count = current.get((filename, lineno), (0, 0))
+            old_size, old_count = previous.get((filename, lineno), (0, 0))
+            if size == old_size and count == old_count:
+                continue
+            top.append({
+                "file": os.path.basename(filename),
+                "line": lineno,
+                "code": linecache.getline(filename, lineno).strip(),
+                "size_diff": size - old_size,
+                "size": size,
+                "count_diff": count - old_count,
+                "count": count,
+            })
+        top.sort(key=lambda site: (abs(site["size_diff"]), site["size"]), reverse=True)
+        return top[:limit]
+
+    def get_stats(self) -> Dict:
+        stats = {"running": self.running, "baseline_at": self.baseline_at}
+        if self.running:
+            current, peak = tracemalloc.get_traced_memory()
+            stats.update({"traced_bytes": current, "peak_bytes": peak,
+                          "overhead_bytes": tracemalloc.get_tracemalloc_memory()})
+        return stats
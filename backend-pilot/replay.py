@@ -0,0 +1,370 @@
+"""
+Enregistrement et rejeu des courses depuis un fichier local indexé
+"""
+
+import asyncio
+import bisect
+import math
+import os
+import re
+import struct
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import GLOBAL_CONFIG
+from serialization import splice
+
+MAGIC = b"PLTRPL1\n"
+# Enregistrement : horodatage epoch (ns), taille du payload, payload JSON
+RECORD_HEADER = struct.Struct("<qI")
+# Entrée d'index : horodatage epoch (ns), position de l'enregistrement dans le fichier
+INDEX_ENTRY = struct.Struct("<qQ")
+RACE_ID_PATTERN = re.compile(r"^[0-9]{8}-[0-9]{6}(-[0-9]+)?$")
+
+
+class ReplayRecorder:
+    """Enregistre chaque instruction traitée dans un fichier par course.
+
+    Le fichier `race-<id>.rec` contient les enregistrements bout à bout ; le
+    fichier `race-<id>.idx` est un index clairsemé (une entrée tous les
+    `index_interval` enregistrements) qui permet un seek en O(log n).
+
+    Une course interrompue (arrêt, redémarrage) est reprise en ajout à la
+    fin de ses fichiers. Au-delà de `max_races` courses ou de `max_bytes`
+    octets (0 = sans limite), les plus anciennes sont supprimées.
+    """
+
+    def __init__(self, directory: str = "replays", index_interval: int = 32, enabled: bool = True,
+                 max_races: int = 20, max_bytes: int = 0):
+        self.directory = directory
+        self.index_interval = index_interval
+        self.enabled = enabled
+        self.max_races = max_races
+        self.max_bytes = max_bytes
+        self.race_id: Optional[str] = None
+        self._lock = threading.Lock()
+        self._records = None
+        self._index = None
+        self._count = 0
+
+    @classmethod
+    def from_config(cls):
+        """Construit l'enregistreur à partir de la section DEFAULT de config.ini"""
+        return cls(
+            directory=GLOBAL_CONFIG.get('DEFAULT', 'replay_dir', fallback='replays'),
+            index_interval=GLOBAL_CONFIG.getint('DEFAULT', 'replay_index_interval', fallback=32),
+            enabled=GLOBAL_CONFIG.getboolean('DEFAULT', 'replay_enabled', fallback=True),
+            max_races=GLOBAL_CONFIG.getint('DEFAULT', 'replay_max_races', fallback=20),
+            max_bytes=GLOBAL_CONFIG.getint('DEFAULT', 'replay_max_bytes', fallback=0),
+        )
+
+    def start_race(self, resume: Optional[str] = None) -> Optional[str]:
+        """Reprend la course `resume` si elle existe encore, sinon en ouvre une nouvelle.
+
+        Returns:
+            L'identifiant de la course enregistrée (None si l'enregistrement est désactivé)
+        """
+        if not self.enabled:
+            return None
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        if isinstance(resume, str) and RACE_ID_PATTERN.match(resume) and self._resume(resume):
+            self._prune()
+            return resume
+        race_id = time.strftime("%Y%m%d-%H%M%S")
+        suffix = 1
+        while os.path.exists(self._path(race_id, "rec")):
+            suffix += 1
+            race_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{suffix}"
+        with self._lock:
+            self.race_id = race_id
+            self._records = open(self._path(race_id, "rec"), "wb")
+            self._records.write(MAGIC)
+            self._index = open(self._path(race_id, "idx"), "wb")
+            self._count = 0
+        self._prune()
+        return race_id
+
+    def _resume(self, race_id: str) -> bool:
+        """Rouvre une course en ajout, après le dernier enregistrement complet"""
+        records_path, index_path = self._path(race_id, "rec"), self._path(race_id, "idx")
+        if not os.path.exists(records_path) or not os.path.exists(index_path):
+            return False
+        reader = ReplayReader(race_id, records_path, index_path)
+        end = reader.end_position()
+        if end is None:
+            return False
+        with self._lock:
+            self.race_id = race_id
+            self._records = open(records_path, "r+b")
+            self._records.truncate(end)
+            self._records.seek(end)
+            self._index = open(index_path, "r+b")
+            # Entrées d'index valides : celles qui pointent avant la fin tronquée
+            self._index.truncate(bisect.bisect_left(reader.index_positions, end) * INDEX_ENTRY.size)
+            self._index.seek(0, os.SEEK_END)
+            # Le premier enregistrement repris est indexé
+            self._count = 0
+        return True
+
+    def _prune(self):
+        """Supprime les courses les plus anciennes au-delà des limites (jamais la course en cours)"""
+        races = [(race_id, os.path.getsize(self._path(race_id, "rec"))) for race_id in self._race_ids()]
+        count = len(races)
+        total_bytes = sum(size for _, size in races)
+        for race_id, size in races:
+            over_count = self.max_races and count > self.max_races
+            over_bytes = self.max_bytes and total_bytes > self.max_bytes
+            if not (over_count or over_bytes):
+                break
+            if race_id == self.race_id:
+                continue
+            for extension in ("rec", "idx"):
+                try:
+                    os.remove(self._path(race_id, extension))
+                except FileNotFoundError:
+                    pass
+            count -= 1
+            total_bytes -= size
+
+    def end_race(self):
+        """Ferme la course en cours ; le prochain `start_race` en ouvrira une nouvelle"""
+        self.close()
+        self.race_id = None
+
+    def record(self, payload: bytes):
+        """Ajoute une instruction (JSON encodé) à la course en cours"""
+        with self._lock:
+            if self._records is None:
+                return
+            timestamp = time.time_ns()
+            position = self._records.tell()
+            if self._count % self.index_interval == 0:
+                self._index.write(INDEX_ENTRY.pack(timestamp, position))
+                # Rendre visible aux lecteurs au moins jusqu'à ce point d'index
+                self._records.flush()
+                self._index.flush()
+            self._records.write(RECORD_HEADER.pack(timestamp, len(payload)))
+            self._records.write(payload)
+            self._count += 1
+
+    def flush(self):
+        with self._lock:
+            if self._records is not None:
+                self._records.flush()
+                self._index.flush()
+
+    def close(self):
+        """Ferme la course en cours"""
+        with self._lock:
+            if self._records is not None:
+                self._records.close()
+                self._index.close()
+            self._records = None
+            self._index = None
+
+    def list_races(self) -> List[Dict]:
+        """Courses enregistrées, la plus récente en premier"""
+        if not os.path.isdir(self.directory):
+            return []
+        self.flush()
+        races = []
+        for race_id in reversed(self._race_ids()):
+            reader = self.open_reader(race_id)
+            if reader:
+                races.append(reader.describe())
+        return races
+
+    def _race_ids(self) -> List[str]:
+        """Identifiants des courses enregistrées, de la plus ancienne à la plus récente"""
+        race_ids = []
+        for filename in os.listdir(self.directory):
+            if filename.startswith("race-") and filename.endswith(".rec"):
+                race_id = filename[len("race-"):-len(".rec")]
+                if RACE_ID_PATTERN.match(race_id):
+                    race_ids.append(race_id)
+        # Horodatage puis suffixe numérique (…-2 avant …-10)
+        return sorted(race_ids, key=lambda race_id: (race_id[:15], int(race_id[16:] or 1)))
+
+    def open_reader(self, race_id: str) -> Optional["ReplayReader"]:
+        """Ouvre une course enregistrée en lecture, ou None si elle n'existe pas"""
+        if not isinstance(race_id, str) or not RACE_ID_PATTERN.match(race_id) or not os.path.exists(self._path(race_id, "rec")):
+            return None
+        if race_id == self.race_id:
+            self.flush()
+        return ReplayReader(race_id, self._path(race_id, "rec"), self._path(race_id, "idx"))
+
+    def _path(self, race_id: str, extension: str) -> str:
+        return os.path.join(self.directory, f"race-{race_id}.{extension}")
+
+
+class ReplayReader:
+    """Lecture d'une course avec seek temporel par l'index clairsemé"""
+
+    def __init__(self, race_id: str, records_path: str, index_path: str):
+        self.race_id = race_id
+        self.records_path = records_path
+        self.index_timestamps: List[int] = []
+        self.index_positions: List[int] = []
+        with open(index_path, "rb") as f:
+            data = f.read()
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        for timestamp, position in INDEX_ENTRY.iter_unpack(data[:usable]):
+            self.index_timestamps.append(timestamp)
+            self.index_positions.append(position)
+
+    def end_position(self) -> Optional[int]:
+        """Position de fin du dernier enregistrement complet, ou None si le fichier est invalide"""
+        with open(self.records_path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            position = self.index_positions[-1] if self.index_positions else len(MAGIC)
+            f.seek(position)
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return position
+                _, length = RECORD_HEADER.unpack(header)
+                if len(f.read(length)) < length:
+                    return position
+                position += RECORD_HEADER.size + length
+
+    @property
+    def start_ns(self) -> Optional[int]:
+        return self.index_timestamps[0] if self.index_timestamps else None
+
+    def describe(self) -> Dict:
+        return {
+            "race_id": self.race_id,
+            "started_at": self.start_ns / 1e9 if self.start_ns else None,
+            "size_bytes": os.path.getsize(self.records_path),
+        }
+
+    def records(self, offset_ms: float = 0.0) -> Iterator[Tuple[float, bytes]]:
+        """Itère sur (décalage depuis le départ en ms, payload) à partir de `offset_ms`"""
+        if self.start_ns is None:
+            return
+        target = self.start_ns + int(offset_ms * 1_000_000)
+        slot = max(bisect.bisect_right(self.index_timestamps, target) - 1, 0)
+        with open(self.records_path, "rb") as f:
+            f.seek(self.index_positions[slot])
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                timestamp, length = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    return
+                if timestamp >= target:
+                    yield (timestamp - self.start_ns) / 1_000_000, payload
+
+
+class ReplaySession:
+    """Rejeu d'une course pour une connexion WebSocket.
+
+    Modes : lecture à vitesse 1×–`max_speed`× ou image par image
+    (`speed` = 0, chaque `step` envoie l'instruction suivante). `send` reçoit
+    un dict, ou des bytes JSON pour les instructions rejouées (insérées
+    telles qu'enregistrées, sans décodage).
+    """
+
+    def __init__(self, recorder: ReplayRecorder, send: Callable, max_speed: float = 100.0):
+        self.recorder = recorder
+        self.send = send
+        self.max_speed = max_speed
+        self._task: Optional[asyncio.Task] = None
+        self._records: Optional[Iterator] = None
+        self._race_id: Optional[str] = None
+
+    async def handle(self, message: dict):
+        """Traite un message client {"type": "replay", "action": ...}"""
+        action = message.get("action", "play")
+        if action == "play":
+            try:
+                race_id = message.get("race_id")
+                if race_id is not None and not isinstance(race_id, str):
+                    raise ValueError("race_id must be a string")
+                from_ms = _number(message, "from_ms", 0.0)
+                speed = _number(message, "speed", 1.0)
+            except ValueError as e:
+                await self._send_error(str(e))
+                return
+            await self.play(race_id, from_ms, speed)
+        elif action == "step":
+            await self.step()
+        elif action == "stop":
+            self.stop()
+            await self._send_control("stopped")
+        else:
+            await self._send_error(f"Unknown replay action: {action}")
+
+    async def play(self, race_id: Optional[str], from_ms: float, speed: float):
+        self.stop()
+        race_id = race_id or self.recorder.race_id
+        reader = self.recorder.open_reader(race_id) if race_id else None
+        if reader is None:
+            await self._send_error(f"Unknown race: {race_id}")
+            return
+        self._race_id = race_id
+        self._records = reader.records(from_ms)
+        if speed <= 0:
+            await self._send_control("paused", speed=0)
+            return
+        speed = min(max(speed, 1.0), self.max_speed)
+        await self._send_control("playing", speed=speed)
+        self._task = asyncio.create_task(self._stream(speed))
+
+    async def step(self):
+        """Envoie l'instruction suivante (mode image par image)"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._records is None:
+            return
+        record = next(self._records, None)
+        if record is None:
+            await self._finish()
+        else:
+            await self._send_record(*record)
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self._records = None
+
+    async def _stream(self, speed: float):
+        previous_ms = None
+        for offset_ms, payload in self._records:
+            if previous_ms is not None and offset_ms > previous_ms:
+                await asyncio.sleep((offset_ms - previous_ms) / 1000 / speed)
+            previous_ms = offset_ms
+            await self._send_record(offset_ms, payload)
+        self._task = None
+        await self._finish()
+
+    async def _send_record(self, offset_ms: float, payload: bytes):
+        await self.send(splice({"type": "replay", "race_id": self._race_id, "offset_ms": offset_ms},
+                               "data", payload))
+
+    async def _send_control(self, state: str, **extra):
+        await self.send({"type": "replay_control", "race_id": self._race_id, "state": state, **extra})
+
+    async def _send_error(self, message: str):
+        await self.send({"type": "replay_control", "state": "error", "message": message})
+
+    async def _finish(self):
+        self._records = None
+        await self._send_control("finished")
+
+
+def _number(message: dict, field: str, default: float) -> float:
+    """Champ numérique fini et positif d'un message client (`default` si absent)"""
+    value = message.get(field, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{field} must be a number")
+    if not math.isfinite(value) or value < 0:
+        raise ValueError(f"{field} must be a finite, non-negative number")
+    return float(value)
@@ -0,0 +1,61 @@
+"""
+Encodage JSON rapide (bytes) et enveloppes de messages pré-sérialisées
+"""
+
+import json
+from typing import Any, Dict
+
+from pydantic import BaseModel
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+if ORJSON_AVAILABLE:
+    dumps = orjson.dumps
+    loads = orjson.loads
+    JSONDecodeError = orjson.JSONDecodeError
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def dumps(obj: Any) -> bytes:
+        """JSON compact encodé en UTF-8"""
+        return _encoder.encode(obj).encode("utf-8")
+
+    loads = json.loads
+    JSONDecodeError = json.JSONDecodeError
+
+
+def encode_model(model: BaseModel) -> bytes:
+    """JSON d'un modèle pydantic, produit directement en bytes par le sérialiseur compilé"""
+    return type(model).__pydantic_serializer__.to_json(model)
+
+
+def splice(head: Dict, key: str, payload: bytes) -> bytes:
+    """Encode `head` et y insère sous `key` un payload JSON déjà encodé"""
+    return dumps(head)[:-1] + b',' + dumps(key) + b':' + payload + b'}'
+
+
+class Envelope:
+    """Message {"type": ..., <champs fixes>, <key>: <payload>} dont l'en-tête est encodé une seule fois.
+
+    `wrap` insère un payload déjà encodé sans le ré-encoder ; `merge`
+    complète l'en-tête avec des champs variables.
+    """
+
+    __slots__ = ("head", "prefix")
+
+    def __init__(self, message_type: str, key: str = "data", **fields):
+        self.head = dumps({"type": message_type, **fields})[:-1]
+        self.prefix = self.head + b',' + dumps(key) + b':'
+
+    def wrap(self, payload: bytes) -> bytes:
+        """Message complet autour d'un payload JSON déjà encodé"""
+        return self.prefix + payload + b'}'
+
+    def merge(self, fields: Dict) -> bytes:
+        """Message complet avec des champs variables (non vides) après l'en-tête"""
+        return self.head + b',' + dumps(fields)[1:]
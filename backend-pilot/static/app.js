@@ -133,17 +133,27 @@ class BackendPilotApp {
         const wsUrl = `${protocol}//${window.location.host}/ws`;
         
         this.ws = new WebSocket(wsUrl);
+        // Le serveur envoie du JSON UTF-8 en trames binaires
+        this.ws.binaryType = 'arraybuffer';
+        this.textDecoder = this.textDecoder || new TextDecoder();
         
         this.ws.onopen = () => {
             console.log('✅ WebSocket connected');
             this.isConnected = true;
             this.updateConnectionStatus('connected');
             this.addLog('🔌 Connexion WebSocket établie', 'success');
+            // Seuls les canaux affichés par cette page, sans les logs de debug par message
+            this.ws.send(JSON.stringify({
+                type: 'subscribe',
+                channels: ['instruction', 'log', 'leaderboard'],
+                log_level: 'info'
+            }));
         };
         
         this.ws.onmessage = (event) => {
             try {
-                const message = JSON.parse(event.data);
+                const data = typeof event.data === 'string' ? event.data : this.textDecoder.decode(event.data);
+                const message = JSON.parse(data);
                 this.handleWebSocketMessage(message);
             } catch (error) {
                 console.error('Error parsing WebSocket message:', error);
@@ -193,7 +203,27 @@ class BackendPilotApp {
                 break;
                 
             case 'log':
-                this.addLog(message.message);
+                this.addLog(message.message, message.level === 'error' || message.level === 'warning' ? message.level : 'info');
+                break;
+                
+            case 'subscribed':
+                console.log('📬 Subscribed to', message.channels, 'log level', message.log_level);
+                break;
+                
+            case 'error':
+                this.addLog(`❌ ${message.message}`, 'error');
+                break;
+                
+            case 'leaderboard':
+                this.handleLeaderboard(message.data);
+                break;
+                
+            case 'replay':
+                this.handleNewInstruction(message.data);
+                break;
+                
+            case 'replay_control':
+                this.addLog(`🎬 Replay ${message.race_id || ''}: ${message.state}`, message.state === 'error' ? 'error' : 'info');
                 break;
                 
             default:
@@ -217,6 +247,15 @@ class BackendPilotApp {
         this.addLog(`📍 ${instruction.action}: ${instruction.target}`, 'info');
     }
     
+    handleLeaderboard(update) {
+        // Signaler dans les logs les changements de rang au sein du top
+        update.changes
+            .filter((change) => change.rank !== null && change.previous_rank !== null)
+            .forEach((change) => {
+                this.addLog(`🏆 ${change.group_id}: #${change.previous_rank} → #${change.rank}`, 'info');
+            });
+    }
+    
     updateCarPosition(newPosition) {
         console.log('🚗 Updating car position to:', newPosition);
         
@@ -0,0 +1,128 @@
+"""
+Pipeline des fichiers statiques : variantes gzip/brotli précalculées, URLs hashées et ETags
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+from typing import Dict, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+
+# En dessous de cette taille la compression ne vaut pas l'en-tête Content-Encoding
+MIN_COMPRESS_SIZE = 512
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+mimetypes.add_type("application/javascript", ".js")
+mimetypes.add_type("image/svg+xml", ".svg")
+
+
+class Asset:
+    """Fichier statique chargé en mémoire avec ses variantes encodées"""
+
+    __slots__ = ("name", "hashed_name", "media_type", "digest", "variants")
+
+    def __init__(self, name: str, content: bytes, media_type: str):
+        self.name = name
+        self.media_type = media_type
+        self.digest = hashlib.sha256(content).hexdigest()[:12]
+        root, ext = os.path.splitext(name)
+        self.hashed_name = f"{root}.{self.digest}{ext}"
+        # encodage -> (corps, ETag fort propre à cette représentation)
+        self.variants: Dict[str, tuple] = {"identity": (content, f'"{self.digest}"')}
+
+        if len(content) >= MIN_COMPRESS_SIZE and media_type.startswith(COMPRESSIBLE_TYPES):
+            gzipped = gzip.compress(content, compresslevel=9, mtime=0)
+            if len(gzipped) < len(content):
+                self.variants["gzip"] = (gzipped, f'"{self.digest}-gz"')
+            if BROTLI_AVAILABLE:
+                compressed = brotli.compress(content, quality=11)
+                if len(compressed) < len(content):
+                    self.variants["br"] = (compressed, f'"{self.digest}-br"')
+
+    def etags(self):
+        return {etag for _, etag in self.variants.values()}
+
+    def negotiate(self, accept_encoding: str) -> str:
+        """Choisit la meilleure variante acceptée par le client (br > gzip > identity)"""
+        accepted = {token.split(";")[0].strip() for token in accept_encoding.lower().split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and (encoding in accepted or "*" in accepted):
+                return encoding
+        return "identity"
+
+
+class StaticAssets:
+    """Charge les fichiers statiques une fois au démarrage et les sert depuis la mémoire.
+
+    Chaque fichier est accessible sous son nom (`/static/app.js`, revalidé à
+    chaque chargement) et sous un nom hashé par son contenu
+    (`/static/app.<hash>.js`, cache immuable d'un an). Les requêtes
+    conditionnelles reçoivent un 304 sans accès disque.
+    """
+
+    def __init__(self, directory: str, url_prefix: str = "/static"):
+        self.directory = directory
+        self.url_prefix = url_prefix.rstrip("/")
+        self.assets: Dict[str, Asset] = {}
+        self._by_url_name: Dict[str, tuple] = {}
+
+    def build(self):
+        """Charge et compresse tous les fichiers du répertoire statique"""
+        assets = {}
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+                with open(path, "rb") as f:
+                    assets[name] = Asset(name, f.read(), media_type)
+        self.assets = assets
+        self._by_url_name = {}
+        for asset in assets.values():
+            self._by_url_name[asset.name] = (asset, REVALIDATE_CACHE)
+            self._by_url_name[asset.hashed_name] = (asset, IMMUTABLE_CACHE)
+        return self
+
+    def url(self, name: str) -> str:
+        """URL hashée d'un fichier statique, à utiliser dans les templates"""
+        asset = self.assets.get(name)
+        return f"{self.url_prefix}/{asset.hashed_name if asset else name}"
+
+    def response(self, request: Request, url_name: str) -> Optional[Response]:
+        """Réponse HTTP pour un fichier, ou None s'il est inconnu"""
+        entry = self._by_url_name.get(url_name)
+        if entry is None:
+            return None
+        asset, cache_control = entry
+        return asset_response(request, asset, cache_control)
+
+
+def asset_response(request: Request, asset: Asset, cache_control: str) -> Response:
+    """Sert la meilleure variante d'un asset, ou un 304 si le client l'a déjà"""
+    encoding = asset.negotiate(request.headers.get("accept-encoding", ""))
+    body, etag = asset.variants[encoding]
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = {tag.strip() for tag in if_none_match.split(",")}
+        candidates |= {tag[2:] for tag in candidates if tag.startswith("W/")}
+        if "*" in candidates or candidates & asset.etags():
+            return Response(status_code=304, headers=headers)
+
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=asset.media_type, headers=headers)
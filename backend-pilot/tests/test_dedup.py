@@ -0,0 +1,137 @@
+"""
+Tests du filtre de déduplication des instructions
+"""
+
+import random
+
+from dedup import InstructionDeduplicator
+
+
+def make(tmp_path, **kwargs):
+    kwargs.setdefault("bits_log2", 16)
+    kwargs.setdefault("capacity", 1000)
+    kwargs.setdefault("window", 64)
+    return InstructionDeduplicator(group_id="group-a", path=str(tmp_path / "dedup.bin"), **kwargs)
+
+
+def test_second_delivery_is_duplicate(tmp_path):
+    dedup = make(tmp_path)
+    assert not dedup.is_duplicate("1")
+    assert dedup.is_duplicate("1")
+    assert not dedup.is_duplicate("2")
+    assert dedup.get_stats()["duplicates_dropped"] == 1
+
+
+def test_keys_in_the_window_are_never_false_positives(tmp_path):
+    # Table minuscule (2 empreintes par génération) : seule la fenêtre peut répondre juste
+    dedup = make(tmp_path, bits_log2=7, capacity=2, window=5000)
+    keys = [str(i) for i in range(5000)]
+    assert not any(dedup.is_duplicate(key) for key in keys)
+    assert dedup.get_stats() == {"enabled": True, "duplicates_dropped": 0, "window": 5000,
+                                 "archived": 0, "memory_bytes": 32}
+    assert all(dedup.is_duplicate(key) for key in keys)
+
+
+def test_archived_keys_have_no_false_positives_at_full_load(tmp_path):
+    dedup = make(tmp_path, window=256)
+    for i in range(2256):
+        dedup.is_duplicate(str(i))
+    assert dedup.current_count + dedup.previous_count >= dedup.capacity
+    rng = random.Random(3)
+    probes = ["%x" % rng.getrandbits(64) for _ in range(20_000)] + [str(10**6 + i) for i in range(20_000)]
+    false_positives = 0
+    for key in probes:
+        false_positives += dedup.is_duplicate(key)
+        dedup.forget(key)
+    assert false_positives == 0
+    # Ni faux négatif : la fenêtre et les deux générations reconnaissent leurs clés
+    assert all(dedup.is_duplicate(str(i)) for i in range(2256 - 256 - dedup.previous_count, 2256))
+
+
+def test_save_load_round_trip(tmp_path):
+    dedup = make(tmp_path)
+    for i in range(500):
+        dedup.is_duplicate(str(i))
+    dedup.forget("498")
+    progress = {"total_km_travelled": 12.5, "instruction_counter": 500, "checkpoint_counter": 500,
+                "race_id": "20260101-000000"}
+    dedup.save(progress)
+
+    restored = make(tmp_path)
+    assert restored.progress == progress
+    assert restored.words == dedup.words
+    assert (restored.generation, restored.current_count) == (dedup.generation, dedup.current_count)
+    # La fenêtre est restaurée exactement, dans l'ordre
+    assert restored._window_keys() == dedup._window_keys()
+    assert "498" not in restored.recent
+    assert all(restored.is_duplicate(str(i)) for i in range(500) if i != 498)
+    assert not restored.is_duplicate("498")
+    assert not restored.is_duplicate("500")
+
+
+def test_load_into_smaller_window_archives_oldest_keys(tmp_path):
+    dedup = make(tmp_path, window=64)
+    for i in range(64):
+        dedup.is_duplicate(str(i))
+    dedup.save()
+
+    restored = make(tmp_path, window=16)
+    assert restored._window_keys() == [str(i) for i in range(48, 64)]
+    assert restored.current_count == 48
+    assert all(restored.is_duplicate(str(i)) for i in range(64))
+
+
+def test_state_of_another_group_is_ignored(tmp_path):
+    dedup = make(tmp_path)
+    dedup.is_duplicate("1")
+    dedup.save({"total_km_travelled": 1.0})
+
+    other = InstructionDeduplicator(group_id="group-b", bits_log2=16, capacity=1000,
+                                    path=str(tmp_path / "dedup.bin"))
+    assert other.progress == {}
+    assert not other.is_duplicate("1")
+
+
+def test_forget_on_reject(tmp_path):
+    dedup = make(tmp_path)
+    assert not dedup.is_duplicate("rejected")
+    assert dedup.forget("rejected")
+    # L'instruction rejetée peut être redélivrée corrigée
+    assert not dedup.is_duplicate("rejected")
+    assert not dedup.forget("unknown")
+
+
+def test_forget_any_key_still_in_the_window(tmp_path):
+    dedup = make(tmp_path, window=4)
+    for key in "abcd":
+        dedup.is_duplicate(key)
+    assert dedup.forget("b")
+    assert not dedup.forget("b")
+    assert not dedup.is_duplicate("b")
+    # La réinsertion de "b" a fait sortir "a" (la plus ancienne) vers la table
+    assert dedup._window_keys() == ["c", "d", "b"]
+    assert dedup.current_count == 1
+    assert [dedup.is_duplicate(key) for key in "acd"] == [True, True, True]
+
+
+def test_rotation_bounds_memory(tmp_path):
+    dedup = make(tmp_path, capacity=100, window=10)
+    size = dedup.get_stats()["memory_bytes"]
+    for i in range(1000):
+        dedup.is_duplicate(str(i))
+    assert dedup.get_stats()["memory_bytes"] == size
+    assert dedup.current_count + dedup.previous_count <= 200
+    # La fenêtre et les deux dernières générations sont encore connues
+    assert all(dedup.is_duplicate(str(i)) for i in range(900, 1000))
+
+
+def test_clear_removes_state_and_progress(tmp_path):
+    dedup = make(tmp_path)
+    dedup.is_duplicate("1")
+    dedup.save({"total_km_travelled": 3.0})
+    dedup.clear()
+    assert not (tmp_path / "dedup.bin").exists()
+    assert dedup.progress == {}
+    assert dedup._window_keys() == []
+    assert not dedup.is_duplicate("1")
+    assert make(tmp_path).progress == {}
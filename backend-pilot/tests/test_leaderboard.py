@@ -0,0 +1,66 @@
+"""
+Tests du classement top-K incrémental
+"""
+
+import random
+
+from leaderboard import Leaderboard
+
+
+def brute_force(latest, size):
+    """Top-K de référence : tri complet du dernier km de chaque groupe"""
+    ranked = sorted(latest.items(), key=lambda entry: (-entry[1], entry[0]))[:size]
+    return [(group_id, km) for group_id, km in ranked]
+
+
+def top(leaderboard):
+    return [(entry["group_id"], entry["km_travelled"]) for entry in leaderboard.ranking()]
+
+
+def test_ranking_matches_brute_force_sort():
+    rng = random.Random(42)
+    leaderboard = Leaderboard(size=10)
+    latest = {}
+    for step in range(5000):
+        group_id = f"group-{rng.randrange(200)}"
+        # Les km progressent le plus souvent, mais un groupe peut aussi reculer (reset)
+        km = rng.uniform(0, 100) if rng.random() < 0.1 else latest.get(group_id, 0.0) + rng.uniform(0, 2)
+        leaderboard.update(group_id, km)
+        latest[group_id] = km
+        if step % 50 == 0:
+            assert top(leaderboard) == brute_force(latest, 10)
+    assert top(leaderboard) == brute_force(latest, 10)
+
+
+def test_ranking_with_fewer_groups_than_size():
+    leaderboard = Leaderboard(size=5)
+    for group_id, km in [("a", 1.0), ("b", 3.0), ("c", 2.0), ("b", 0.5)]:
+        leaderboard.update(group_id, km)
+    assert top(leaderboard) == [("c", 2.0), ("a", 1.0), ("b", 0.5)]
+
+
+def test_ties_keep_the_best_kilometres():
+    rng = random.Random(7)
+    leaderboard = Leaderboard(size=4)
+    latest = {}
+    for _ in range(2000):
+        group_id = f"group-{rng.randrange(30)}"
+        km = float(rng.randrange(10))
+        leaderboard.update(group_id, km)
+        latest[group_id] = km
+        # À égalité le choix du groupe est libre, les km du top-K ne le sont pas
+        assert [km for _, km in top(leaderboard)] == [km for _, km in brute_force(latest, 4)]
+
+
+def test_rank_changes_reports_moves_once():
+    leaderboard = Leaderboard(size=2)
+    leaderboard.update("a", 1.0)
+    leaderboard.update("b", 2.0)
+    first = leaderboard.rank_changes()
+    assert [entry["group_id"] for entry in first["top"]] == ["b", "a"]
+    assert leaderboard.rank_changes() is None
+
+    leaderboard.update("c", 3.0)
+    changes = {change["group_id"]: change for change in leaderboard.rank_changes()["changes"]}
+    assert changes["c"]["rank"] == 1 and changes["c"]["previous_rank"] is None
+    assert changes["a"]["rank"] is None and changes["a"]["previous_rank"] == 2
@@ -0,0 +1,114 @@
+"""
+Tests de l'enregistrement et du rejeu des courses
+"""
+
+import asyncio
+import itertools
+import json
+
+import pytest
+
+import replay
+from replay import ReplayRecorder, ReplaySession
+
+START_NS = 1_700_000_000_000_000_000
+STEP_MS = 10
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Horloge de l'enregistreur : un enregistrement toutes les STEP_MS ms"""
+    ticks = itertools.count()
+    monkeypatch.setattr(replay.time, "time_ns", lambda: START_NS + next(ticks) * STEP_MS * 1_000_000)
+
+
+def record_race(recorder, count, resume=None):
+    race_id = recorder.start_race(resume)
+    for i in range(count):
+        recorder.record(b'{"id":"%d"}' % i)
+    recorder.close()
+    return race_id
+
+
+@pytest.mark.parametrize("from_ms", [0, 5, 10, 155, 320, 329.5, 330, 10_000])
+def test_seek_from_offset_matches_full_scan(tmp_path, clock, from_ms):
+    recorder = ReplayRecorder(str(tmp_path), index_interval=8)
+    race_id = record_race(recorder, 40)
+    reader = recorder.open_reader(race_id)
+
+    everything = list(reader.records())
+    assert [offset for offset, _ in everything] == [i * STEP_MS for i in range(40)]
+    assert list(reader.records(from_ms)) == [record for record in everything if record[0] >= from_ms]
+
+
+def test_session_plays_from_offset(tmp_path, clock):
+    recorder = ReplayRecorder(str(tmp_path), index_interval=4)
+    race_id = record_race(recorder, 12)
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def scenario():
+        session = ReplaySession(recorder, send)
+        await session.handle({"type": "replay", "race_id": race_id, "from_ms": 75, "speed": 0})
+        for _ in range(6):
+            await session.handle({"type": "replay", "action": "step"})
+
+    asyncio.run(scenario())
+    assert sent[0]["state"] == "paused"
+    frames = [message for message in sent if isinstance(message, bytes)]
+    assert len(frames) == 4  # offsets 80, 90, 100 et 110 ms
+    assert json.loads(frames[0]) == {"type": "replay", "race_id": race_id, "offset_ms": 80.0, "data": {"id": "8"}}
+    assert sent[-1]["state"] == "finished"
+
+
+@pytest.mark.parametrize("message, error", [
+    ({"speed": None}, "speed must be a number"),
+    ({"from_ms": "abc"}, "from_ms must be a number"),
+    ({"from_ms": -1}, "from_ms must be a finite, non-negative number"),
+    ({"race_id": 12}, "race_id must be a string"),
+    ({"action": "rewind"}, "Unknown replay action: rewind"),
+])
+def test_session_rejects_invalid_requests(tmp_path, message, error):
+    sent = []
+
+    async def send(response):
+        sent.append(response)
+
+    session = ReplaySession(ReplayRecorder(str(tmp_path)), send)
+    asyncio.run(session.handle({"type": "replay", **message}))
+    assert sent == [{"type": "replay_control", "state": "error", "message": error}]
+
+
+def test_resume_appends_after_last_complete_record(tmp_path, clock):
+    recorder = ReplayRecorder(str(tmp_path), index_interval=8)
+    race_id = record_race(recorder, 5)
+    # Enregistrement tronqué par un arrêt brutal
+    with open(recorder._path(race_id, "rec"), "ab") as f:
+        f.write(b"\x01\x02\x03")
+
+    assert record_race(recorder, 3, resume=race_id) == race_id
+    payloads = [payload for _, payload in recorder.open_reader(race_id).records()]
+    assert payloads == [b'{"id":"%d"}' % i for i in [0, 1, 2, 3, 4, 0, 1, 2]]
+    # Le premier enregistrement repris est indexé
+    assert len(recorder.open_reader(race_id).index_positions) == 2
+
+
+def test_retention_keeps_newest_races(tmp_path, clock):
+    recorder = ReplayRecorder(str(tmp_path), max_races=3)
+    for stamp in ["20260101-000000", "20260101-000000-2", "20260101-000000-10", "20260101-000001"]:
+        (tmp_path / f"race-{stamp}.rec").write_bytes(replay.MAGIC)
+        (tmp_path / f"race-{stamp}.idx").write_bytes(b"")
+
+    race_id = record_race(recorder, 1)
+    assert recorder._race_ids() == ["20260101-000000-10", "20260101-000001", race_id]
+    assert not (tmp_path / "race-20260101-000000-2.idx").exists()
+
+
+def test_retention_by_size_never_removes_current_race(tmp_path, clock):
+    recorder = ReplayRecorder(str(tmp_path), max_races=0, max_bytes=1)
+    first = record_race(recorder, 2)
+    second = recorder.start_race()
+    assert recorder._race_ids() == [second]
+    assert first != second
@@ -0,0 +1,76 @@
+"""
+Tests des enveloppes pré-encodées, avec orjson et avec le repli json
+"""
+
+import importlib
+import json
+import sys
+
+import pytest
+
+import serialization
+from kafka_service import Instruction
+
+
+@pytest.fixture(params=["orjson", "json"])
+def codec(request, monkeypatch):
+    """Module serialization rechargé avec chacun des deux encodeurs"""
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setitem(sys.modules, "orjson", None)
+    module = importlib.reload(serialization)
+    assert module.ORJSON_AVAILABLE == (request.param == "orjson")
+    yield module
+    monkeypatch.undo()
+    importlib.reload(serialization)
+
+
+PAYLOADS = [
+    {"id": "1", "km_gain": 0.15},
+    [1, 2.5, None, True],
+    "Arrivée - ENSIMAG \"quoted\" \\ ✅",
+    {},
+    0,
+]
+
+
+@pytest.mark.parametrize("payload", PAYLOADS)
+def test_wrap(codec, payload):
+    envelope = codec.Envelope("instruction")
+    assert json.loads(envelope.wrap(codec.dumps(payload))) == {"type": "instruction", "data": payload}
+
+
+def test_wrap_with_fixed_fields_and_key(codec):
+    envelope = codec.Envelope("log", key="message", level="debug", source="pilote é")
+    assert json.loads(envelope.wrap(codec.dumps("We got a message!"))) == {
+        "type": "log", "level": "debug", "source": "pilote é", "message": "We got a message!",
+    }
+
+
+def test_merge(codec):
+    envelope = codec.Envelope("checkpoint", group_id="group-a")
+    fields = {"step": "3", "id": "3", "km_travelled": 12.5, "event_action": None}
+    assert json.loads(envelope.merge(fields)) == {"type": "checkpoint", "group_id": "group-a", **fields}
+
+
+def test_splice(codec):
+    head = {"type": "replay", "race_id": "20260101-000000", "offset_ms": 80.0}
+    payload = codec.dumps({"id": "8", "target": "Rue de la République"})
+    assert json.loads(codec.splice(head, "data", payload)) == {**head, "data": json.loads(payload)}
+
+
+def test_encode_model_matches_model_dump(codec):
+    instruction = Instruction(id="3", type="instruction", action="turn_right", target="Boulevard Edouard Rey",
+                              km_gain=0.15, latitude=45.1905)
+    encoded = codec.encode_model(instruction)
+    assert isinstance(encoded, bytes)
+    assert json.loads(encoded) == instruction.model_dump()
+    assert json.loads(codec.Envelope("instruction").wrap(encoded))["data"] == instruction.model_dump()
+
+
+def test_dumps_round_trip(codec):
+    for payload in PAYLOADS:
+        encoded = codec.dumps(payload)
+        assert isinstance(encoded, bytes)
+        assert codec.loads(encoded) == payload
@@ -0,0 +1,62 @@
+"""
+Tests des abonnements WebSocket par canal
+"""
+
+import pytest
+
+from app import DEFAULT_CHANNELS, ConnectionManager, Subscription
+
+
+def connected(manager, websocket="ws"):
+    """Connexion avec l'abonnement implicite (sans passer par accept())"""
+    manager.active_connections.append(websocket)
+    manager._index(websocket, Subscription(DEFAULT_CHANNELS, implicit=True))
+    return websocket
+
+
+def test_first_subscribe_with_channels_replaces_implicit_subscription():
+    manager = ConnectionManager()
+    ws = connected(manager)
+    assert manager.subscribe(ws, ["status"]).describe()["channels"] == ["status"]
+    assert manager.subscribe(ws, ["log"]).describe()["channels"] == ["log", "status"]
+
+
+def test_subscribe_without_channels_keeps_implicit_channels():
+    manager = ConnectionManager()
+    ws = connected(manager)
+    subscription = manager.subscribe(ws, log_level="warning", pilots=["group-a"])
+    assert subscription.channels == set(DEFAULT_CHANNELS)
+    assert subscription.pilots == {"group-a"}
+    assert manager.has_subscribers("log")
+    # Le premier choix explicite de canaux remplace toujours l'abonnement implicite
+    assert manager.subscribe(ws, ["status"]).describe() == {
+        "channels": ["status"], "log_level": "warning", "pilots": ["group-a"]}
+
+
+@pytest.mark.parametrize("field, value", [
+    ("channels", "log"), ("channels", None), ("channels", ["log", 1]), ("channels", {"log": 1}),
+    ("pilots", "abc"), ("pilots", [None]), ("pilots", 42),
+])
+def test_subscribe_rejects_values_that_are_not_lists_of_strings(field, value):
+    manager = ConnectionManager()
+    ws = connected(manager)
+    with pytest.raises(ValueError, match=field):
+        manager.subscribe(ws, **{field: value})
+    # L'abonnement n'est pas modifié
+    assert manager.subscriptions[ws].implicit
+
+
+def test_pilots_none_restores_all_pilots():
+    manager = ConnectionManager()
+    ws = connected(manager)
+    manager.subscribe(ws, ["instruction"], pilots=["group-a"])
+    assert manager.subscribe(ws, pilots=None).pilots is None
+
+
+def test_unsubscribe_validates_channels():
+    manager = ConnectionManager()
+    ws = connected(manager)
+    with pytest.raises(ValueError):
+        manager.unsubscribe(ws, "log")
+    assert manager.unsubscribe(ws, ["log"]).channels == {"instruction", "leaderboard"}
+    assert not manager.has_subscribers("log")
@@ -0,0 +1,190 @@
+"""
+Traçage de bout en bout des instructions (en-têtes Kafka -> spans OpenTelemetry)
+"""
+
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+from config import GLOBAL_CONFIG
+
+try:
+    from opentelemetry import trace as otel_trace
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    from opentelemetry.sdk.trace.sampling import ALWAYS_ON
+    from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+    OTEL_AVAILABLE = True
+except ImportError:
+    OTEL_AVAILABLE = False
+
+
+# En-tête optionnel posé par le serveur de course (epoch en millisecondes)
+PRODUCER_TIMESTAMP_HEADER = "producer_timestamp_ms"
+TRACE_HEADERS = ("traceparent", "tracestate")
+
+
+class MessageTrace:
+    """Horodatages monotones d'une instruction échantillonnée, de sa lecture à son checkpoint"""
+
+    __slots__ = ("root_span", "parent_context", "topic", "partition", "offset", "producer_ts_ns",
+                 "wall_offset_ns", "polled", "validated", "broadcasted", "checkpoint_sent",
+                 "checkpoint_delivered", "instruction_id")
+
+    def __init__(self, parent_context, topic, partition, offset, producer_ts_ns):
+        self.root_span = None
+        self.parent_context = parent_context
+        self.topic = topic
+        self.partition = partition
+        self.offset = offset
+        self.producer_ts_ns = producer_ts_ns
+        # Permet de convertir les instants monotones en epoch pour l'export
+        self.wall_offset_ns = time.time_ns() - time.monotonic_ns()
+        self.polled = time.monotonic_ns()
+        self.validated = None
+        self.broadcasted = None
+        self.checkpoint_sent = None
+        self.checkpoint_delivered = None
+        self.instruction_id = None
+
+    def mark(self, hop: str):
+        """Enregistre l'instant monotone d'une étape (validated, broadcasted, ...)"""
+        setattr(self, hop, time.monotonic_ns())
+
+    def wall(self, monotonic_ns: int) -> int:
+        return monotonic_ns + self.wall_offset_ns
+
+
+class MessageTracer:
+    """Échantillonne les instructions et exporte la latence par étape vers otelcol/Tempo.
+
+    La décision d'échantillonnage est prise une seule fois à la lecture du
+    message ; pour un message non échantillonné `start` renvoie None et
+    toutes les étapes suivantes se réduisent à un test `if trace`.
+    """
+
+    def __init__(self, enabled: bool = False, sample_ratio: float = 0.01,
+                 endpoint: str = "http://localhost:4242", service_name: str = "backend-pilot"):
+        self.sample_ratio = sample_ratio
+        self.enabled = enabled and OTEL_AVAILABLE and sample_ratio > 0
+        self.exported = 0
+        self._tracer = None
+        self._propagator = None
+        self._provider = None
+
+        if enabled and not OTEL_AVAILABLE:
+            print("⚠️ Tracing enabled but opentelemetry is not installed (pip install backend-pilot[tracing])")
+
+        if self.enabled:
+            self._provider = TracerProvider(
+                resource=Resource.create({"service.name": service_name}),
+                sampler=ALWAYS_ON,
+            )
+            self._provider.add_span_processor(
+                BatchSpanProcessor(OTLPSpanExporter(endpoint=f"{endpoint.rstrip('/')}/v1/traces"))
+            )
+            self._tracer = self._provider.get_tracer("backend-pilot.kafka")
+            self._propagator = TraceContextTextMapPropagator()
+
+    @classmethod
+    def from_config(cls):
+        """Construit le traceur à partir de la section DEFAULT de config.ini"""
+        return cls(
+            enabled=GLOBAL_CONFIG.getboolean('DEFAULT', 'tracing_enabled', fallback=False),
+            sample_ratio=GLOBAL_CONFIG.getfloat('DEFAULT', 'tracing_sample_ratio', fallback=0.01),
+            endpoint=GLOBAL_CONFIG.get('DEFAULT', 'otel_endpoint', fallback='http://localhost:4242'),
+            service_name=GLOBAL_CONFIG.get('DEFAULT', 'otel_service_name', fallback='backend-pilot'),
+        )
+
+    def start(self, msg) -> Optional[MessageTrace]:
+        """Décide de l'échantillonnage et ouvre la trace d'un message fraîchement lu"""
+        if not self.enabled or random.random() >= self.sample_ratio:
+            return None
+
+        carrier: Dict[str, str] = {}
+        producer_ts_ns = None
+        for key, value in msg.headers() or []:
+            if key in TRACE_HEADERS and value is not None:
+                carrier[key] = value.decode("ascii", "replace")
+            elif key == PRODUCER_TIMESTAMP_HEADER and value is not None:
+                try:
+                    producer_ts_ns = int(value) * 1_000_000
+                except ValueError:
+                    pass
+        if producer_ts_ns is None:
+            timestamp_type, timestamp_ms = msg.timestamp()
+            if timestamp_type != 0 and timestamp_ms > 0:  # 0 = TIMESTAMP_NOT_AVAILABLE
+                producer_ts_ns = timestamp_ms * 1_000_000
+
+        trace = MessageTrace(
+            parent_context=self._propagator.extract(carrier),
+            topic=msg.topic(),
+            partition=msg.partition(),
+            offset=msg.offset(),
+            producer_ts_ns=producer_ts_ns,
+        )
+        trace.root_span = self._tracer.start_span(
+            "pilot.instruction",
+            context=trace.parent_context,
+            kind=otel_trace.SpanKind.CONSUMER,
+            start_time=trace.wall(trace.polled),
+            attributes={
+                "messaging.system": "kafka",
+                "messaging.destination.name": trace.topic,
+                "messaging.kafka.destination.partition": trace.partition,
+                "messaging.kafka.message.offset": trace.offset,
+            },
+        )
+        return trace
+
+    def outgoing_headers(self, trace: Optional[MessageTrace]) -> Optional[List[Tuple[str, bytes]]]:
+        """En-têtes W3C à joindre au checkpoint pour prolonger la trace côté serveur"""
+        if trace is None or trace.root_span is None:
+            return None
+        carrier: Dict[str, str] = {}
+        self._propagator.inject(carrier, context=otel_trace.set_span_in_context(trace.root_span))
+        return [(key, value.encode("ascii")) for key, value in carrier.items()]
+
+    def finish(self, trace: Optional[MessageTrace], error: Optional[str] = None):
+        """Ferme la trace et émet un span par étape (l'export se fait en tâche de fond)"""
+        if trace is None or trace.root_span is None:
+            return
+        root = trace.root_span
+        trace.root_span = None
+        parent = otel_trace.set_span_in_context(root)
+        end = trace.checkpoint_delivered or time.monotonic_ns()
+
+        if trace.instruction_id is not None:
+            root.set_attribute("pilot.instruction.id", trace.instruction_id)
+        if trace.producer_ts_ns is not None:
+            transit = self._tracer.start_span("kafka.transit", context=parent, start_time=trace.producer_ts_ns)
+            transit.end(end_time=max(trace.producer_ts_ns, trace.wall(trace.polled)))
+
+        hops = (
+            ("pilot.validate", trace.polled, trace.validated),
+            ("pilot.ui.broadcast", trace.validated, trace.broadcasted),
+            ("pilot.checkpoint.deliver", trace.checkpoint_sent, trace.checkpoint_delivered),
+        )
+        for name, start, stop in hops:
+            if start is not None and stop is not None:
+                span = self._tracer.start_span(name, context=parent, start_time=trace.wall(start))
+                span.end(end_time=trace.wall(stop))
+
+        if error:
+            root.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, error))
+        root.end(end_time=trace.wall(end))
+        self.exported += 1
+
+    def shutdown(self):
+        """Exporte les spans restants avant l'arrêt"""
+        if self._provider:
+            self._provider.shutdown()
+
+    def get_stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "sample_ratio": self.sample_ratio,
+            "exported": self.exported,
+        }